@@ -0,0 +1,82 @@
+"""
+Compare benchmark results saved by run.py.
+
+    python benchmarks/compare.py before.json after.json [more.json ...]
+
+Prints each metric for every results file, relative to the first one.
+For times lower is better, for rates higher is better.
+"""
+import argparse
+import json
+from typing import Dict
+from typing import Iterator
+from typing import Tuple
+
+# metric shown for each benchmark and whether higher value is better
+METRICS = {
+    "convert": ("ms_per_article", False),
+    "read": ("articles_per_s", True),
+    "create_slob": ("articles_per_s", True),
+}
+
+
+def metrics(report: dict) -> Iterator[Tuple[str, float, bool]]:
+    results = report["results"]
+    for benchmark, (metric, higher_is_better) in METRICS.items():
+        result = results.get(benchmark)
+        if not result:
+            continue
+        if benchmark == "convert":
+            for kind, values in result.items():
+                yield f"convert {kind} ({metric})", values[metric], higher_is_better
+        elif benchmark == "create_slob" and metric not in result:
+            # results for each executor
+            for executor, values in result.items():
+                yield f"{benchmark} {executor} ({metric})", values[metric], True
+        else:
+            yield f"{benchmark} ({metric})", result[metric], higher_is_better
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("results", nargs="+")
+    args = parser.parse_args()
+    reports = []
+    for name in args.results:
+        with open(name) as f:
+            reports.append(json.load(f))
+    if len({json.dumps(r["config"], sort_keys=True) for r in reports}) > 1:
+        print("Warning: results were produced with different configurations\n")
+
+    labels = [r["commit"] or name for r, name in zip(reports, args.results)]
+    rows: Dict[str, list] = {}
+    better: Dict[str, bool] = {}
+    for i, report in enumerate(reports):
+        for name, value, higher_is_better in metrics(report):
+            rows.setdefault(name, [None] * len(reports))[i] = value
+            better[name] = higher_is_better
+
+    width = max(len(name) for name in rows) if rows else 10
+    print(f"{'':{width}}", *(f"{label[:22]:>22}" for label in labels))
+    for name, values in rows.items():
+        base = values[0]
+        cells = []
+        for i, value in enumerate(values):
+            if value is None:
+                cells.append(f"{'-':>22}")
+            elif i and base:
+                change = value / base - 1
+                if abs(change) < 0.05:
+                    mark = "  "
+                elif (change > 0) == better[name]:
+                    mark = "ok"
+                else:
+                    mark = "!!"
+                cells.append(f"{value:11.2f} {change:+6.0%} {mark}")
+            else:
+                cells.append(f"{value:22.2f}")
+        print(f"{name:{width}}", *cells)
+
+
+if __name__ == "__main__":
+    main()
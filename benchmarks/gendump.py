@@ -0,0 +1,418 @@
+"""
+Generate synthetic Wikimedia Enterprise HTML dump (tar.gz of NDJSON
+files) and matching siteinfo for benchmarks.
+
+    python benchmarks/gendump.py OUTDIR --articles 5000 [--rtl]
+
+Article markup imitates Parsoid output in enterprise dumps: sections,
+wiki links, references, infoboxes with images, math, geo coordinates,
+Kartographer maps and large tables. Same seed produces same dump.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import tarfile
+from html import escape
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+SERVER = "//bench.wikipedia.org"
+
+# article class: (relative weight, builder)
+KINDS: Dict[str, Tuple[int, Callable]] = {}
+
+WORDS = (
+    "river town population century district railway station church "
+    "village mountain valley north south east west region province "
+    "history culture economy climate geography language people school "
+    "bridge castle museum lake island coast border forest road market"
+).split()
+
+RTL_WORDS = (
+    "נהר עיר אוכלוסייה מאה מחוז רכבת תחנה כנסייה כפר הר עמק צפון דרום "
+    "מזרח מערב אזור היסטוריה תרבות כלכלה אקלים שפה אנשים בית ספר גשר"
+).split()
+
+
+def kind(name: str, weight: int):
+    def register(f):
+        KINDS[name] = (weight, f)
+        return f
+
+    return register
+
+
+class Writer:
+    def __init__(self, rng: random.Random, rtl: bool):
+        self.rng = rng
+        self.words = RTL_WORDS if rtl else WORDS
+        self.ids = 0
+
+    def mwid(self) -> str:
+        self.ids += 1
+        return f"mw{self.ids:X}"
+
+    def sentence(self, links=True) -> str:
+        rng = self.rng
+        parts = []
+        for _ in range(rng.randint(6, 18)):
+            word = rng.choice(self.words)
+            if links and rng.random() < 0.12:
+                target = f"{word.capitalize()} {rng.choice(self.words)}"
+                href = "./" + target.replace(" ", "_")
+                parts.append(
+                    f'<a rel="mw:WikiLink" href="{escape(href)}" '
+                    f'title="{escape(target)}" id="{self.mwid()}">{word}</a>'
+                )
+            elif rng.random() < 0.03:
+                parts.append(f"<b>{word}</b>")
+            else:
+                parts.append(word)
+        if rng.random() < 0.2:
+            n = rng.randint(1, 40)
+            parts.append(
+                f'<sup about="#mwt{n}" class="mw-ref reference" id="cite_ref-{n}" '
+                f'rel="dc:references" typeof="mw:Extension/ref">'
+                f'<a href="./Article#cite_note-{n}" style="counter-reset: mw-Ref {n};">'
+                f'<span class="mw-reflink-text">[{n}]</span></a></sup>'
+            )
+        return " ".join(parts).capitalize() + ". "
+
+    def paragraph(self, sentences=None) -> str:
+        n = sentences or self.rng.randint(2, 7)
+        return f'<p id="{self.mwid()}">{"".join(self.sentence() for _ in range(n))}</p>'
+
+    def image(self, width=220) -> str:
+        name = f"{self.rng.choice(self.words).capitalize()}_{self.rng.randint(1, 9999)}.jpg"
+        src = f"//upload.wikimedia.org/wikipedia/commons/thumb/a/ab/{name}/{width}px-{name}"
+        return (
+            f'<figure typeof="mw:File/Thumb" class="mw-default-size">'
+            f'<a href="./File:{name}" class="mw-file-description">'
+            f'<img resource="./File:{name}" src="{src}" decoding="async" '
+            f'data-file-width="3000" data-file-height="2000" height="147" width="{width}" '
+            f'srcset="{src.replace(f"{width}px", f"{width * 2}px")} 2x, '
+            f'{src.replace(f"{width}px", f"{width * 3 // 2}px")} 1.5x" '
+            f'class="mw-file-element"/></a>'
+            f"<figcaption>{self.sentence(links=False)}</figcaption></figure>"
+        )
+
+    def section(self, level: int, number: int, content: str) -> str:
+        heading = " ".join(self.rng.choice(self.words) for _ in range(2)).capitalize()
+        anchor = heading.replace(" ", "_")
+        return (
+            f'<section data-mw-section-id="{number}" id="{self.mwid()}">'
+            f'<h{level} id="{escape(anchor)}">{heading}</h{level}>{content}</section>'
+        )
+
+    def sections(self, count: int, extra: Callable[[], str] = lambda: "") -> str:
+        out = []
+        for i in range(count):
+            content = "".join(self.paragraph() for _ in range(self.rng.randint(1, 4)))
+            content += extra()
+            if self.rng.random() < 0.4:
+                content += self.section(3, 100 + i, self.paragraph())
+            out.append(self.section(2, i + 1, content))
+        return "".join(out)
+
+    def references(self) -> str:
+        items = "".join(
+            f'<li about="#cite_note-{i}" id="cite_note-{i}">'
+            f'<span class="mw-cite-backlink"><a href="./Article#cite_ref-{i}">↑</a></span> '
+            f'<span id="mw-reference-text-cite_note-{i}" class="mw-reference-text">'
+            f'<a rel="mw:ExtLink nofollow" href="https://example.org/{i}" class="external text">'
+            f"{self.sentence(links=False)}</a></span></li>"
+            for i in range(1, self.rng.randint(5, 40))
+        )
+        return (
+            f'<div class="mw-references-wrap"><ol class="mw-references references" '
+            f'typeof="mw:Extension/references">{items}</ol></div>'
+        )
+
+    def navbox(self) -> str:
+        links = " · ".join(
+            f'<a rel="mw:WikiLink" href="./{w.capitalize()}" title="{w.capitalize()}">{w}</a>'
+            for w in self.rng.sample(self.words, 12)
+        )
+        return (
+            f'<div role="navigation" class="navbox" style="padding:3px">'
+            f'<table class="nowraplinks navbox-inner" style="border-spacing:0;background:transparent;color:inherit">'
+            f'<tbody><tr><td class="navbox-list" style="width:100%;padding:0">{links}</td></tr></tbody></table></div>'
+        )
+
+    def coord(self, lat: float, lon: float) -> str:
+        return (
+            f'<span class="plainlinks nourlexpansion"><a rel="mw:ExtLink" '
+            f'href="https://geohack.toolforge.org/geohack.php?params={lat}_N_{lon}_E" class="external text">'
+            f'<span class="geo-default"><span class="geo-dms" title="Maps, aerial photos, and other data">'
+            f'<span class="latitude">{lat}°N</span> <span class="longitude">{lon}°E</span></span></span>'
+            f'<span class="geo-multi-punct">﻿ / ﻿</span><span class="geo-nondefault">'
+            f'<span class="geo-dec" title="Maps">{lat}°N {lon}°E</span>'
+            f'<span style="display:none">﻿ / <span class="geo">{lat}; {lon}</span></span></span></a></span>'
+        )
+
+    def kartographer(self, lat: float, lon: float) -> str:
+        return (
+            f'<a class="mw-kartographer-map" data-mw="interface" data-style="osm-intl" '
+            f'data-width="250" data-height="250" data-zoom="9" data-lat="{lat}" data-lon="{lon}" '
+            f'data-overlays=\'["_0a5cfb53"]\' href="./Special:Map/9/{lat}/{lon}/en">'
+            f'<img src="https://maps.wikimedia.org/img/osm-intl,9,{lat},{lon},250x250.png?lang=en" '
+            f'width="250" height="250" decoding="async" '
+            f'srcset="https://maps.wikimedia.org/img/osm-intl,9,{lat},{lon},250x250@2x.png?lang=en 2x"/></a>'
+        )
+
+    def infobox(self, rows: int, coords: bool = False) -> str:
+        out = [self.image(250)]
+        for _ in range(rows):
+            label = self.rng.choice(self.words).capitalize()
+            value = " ".join(self.rng.choice(self.words) for _ in range(self.rng.randint(1, 5)))
+            out.append(
+                f'<tr><th scope="row" class="infobox-label">{label}</th>'
+                f'<td class="infobox-data" style="background-color:#f8f9fa">{value}</td></tr>'
+            )
+        if coords:
+            lat, lon = self.latlon()
+            out.append(f'<tr><td colspan="2">{self.coord(lat, lon)}</td></tr>')
+            out.append(f'<tr><td colspan="2">{self.kartographer(lat, lon)}</td></tr>')
+        return (
+            f'<table class="infobox vcard" style="width:22em;background:#f8f9fa">'
+            f'<tbody><tr><td colspan="2" class="infobox-image">{out[0]}</td></tr>'
+            f'{"".join(out[1:])}</tbody></table>'
+        )
+
+    def latlon(self) -> Tuple[float, float]:
+        return (
+            round(self.rng.uniform(-60, 70), 4),
+            round(self.rng.uniform(-170, 170), 4),
+        )
+
+    def math(self) -> str:
+        tex = self.rng.choice(
+            [
+                r"\sum_{i=1}^{n} i = \frac{n(n+1)}{2}",
+                r"E = mc^2",
+                r"\int_0^\infty e^{-x^2}\,dx = \frac{\sqrt{\pi}}{2}",
+                r"\nabla \cdot \mathbf{E} = \frac{\rho}{\varepsilon_0}",
+            ]
+        )
+        data_mw = json.dumps({"name": "math", "attrs": {}, "body": {"extsrc": tex}})
+        return (
+            f'<span class="mwe-math-element" typeof="mw:Extension/math" '
+            f"data-mw='{escape(data_mw, quote=True)}'>"
+            f'<span class="mwe-math-mathml-inline mwe-math-mathml-a11y" style="display: none;">'
+            f'<math xmlns="http://www.w3.org/1998/Math/MathML"><semantics><mrow><mi>x</mi></mrow>'
+            f'<annotation encoding="application/x-tex">{escape(tex)}</annotation></semantics></math></span>'
+            f'<img src="https://wikimedia.org/api/rest_v1/media/math/render/svg/abc" '
+            f'class="mwe-math-fallback-image-inline mw-invert skin-invert" aria-hidden="true" '
+            f'style="vertical-align: -0.838ex; width:12.5ex; height:2.843ex;" alt="{escape(tex)}"/></span>'
+        )
+
+
+@kind("stub", 25)
+def stub_article(w: Writer) -> str:
+    return w.paragraph(2)
+
+
+@kind("text", 35)
+def text_article(w: Writer) -> str:
+    return w.paragraph() + w.sections(w.rng.randint(3, 8)) + w.references() + w.navbox()
+
+
+@kind("infobox", 20)
+def infobox_article(w: Writer) -> str:
+    return (
+        w.infobox(w.rng.randint(8, 30))
+        + w.paragraph()
+        + w.sections(w.rng.randint(3, 8), lambda: w.image() if w.rng.random() < 0.4 else "")
+        + w.references()
+        + w.navbox()
+    )
+
+
+@kind("math", 7)
+def math_article(w: Writer) -> str:
+    return w.paragraph() + w.sections(
+        w.rng.randint(3, 6),
+        lambda: f'<p>{w.sentence()}{w.math()} {w.sentence()}{w.math()}</p>',
+    )
+
+
+@kind("geo", 10)
+def geo_article(w: Writer) -> str:
+    def coords_table() -> str:
+        rows = "".join(
+            f"<tr><td>{w.rng.choice(w.words)}</td><td>{w.coord(*w.latlon())}</td></tr>"
+            for _ in range(w.rng.randint(3, 25))
+        )
+        return f'<table class="wikitable sortable"><tbody>{rows}</tbody></table>'
+
+    return (
+        w.infobox(w.rng.randint(8, 20), coords=True)
+        + w.paragraph()
+        + w.sections(w.rng.randint(2, 5), coords_table)
+        + w.references()
+    )
+
+
+@kind("large", 3)
+def large_article(w: Writer) -> str:
+    rows = "".join(
+        "<tr>"
+        + "".join(
+            f'<td style="background:#{w.rng.randint(0, 0xFFFFFF):06x}">{w.sentence()}</td>'
+            for _ in range(4)
+        )
+        + "</tr>"
+        for _ in range(w.rng.randint(200, 800))
+    )
+    return (
+        w.paragraph()
+        + w.sections(10)
+        + f'<table class="wikitable"><tbody>{rows}</tbody></table>'
+        + w.references()
+    )
+
+
+def page_html(title: str, body: str, rtl: bool = False) -> str:
+    path = escape(title.replace(" ", "_"))
+    direction = "rtl" if rtl else "ltr"
+    return (
+        f'<!DOCTYPE html>\n<html prefix="dc: http://purl.org/dc/terms/ mw: http://mediawiki.org/rdf/"'
+        f' about="https:{SERVER}/wiki/Special:Redirect/revision/1" dir="{direction}"><head prefix="mwr: https:{SERVER}/wiki/Special:Redirect/">'
+        f'<meta charset="utf-8"/><meta property="mw:pageId" content="1"/>'
+        f'<link rel="dc:isVersionOf" href="{SERVER}/wiki/{path}"/>'
+        f'<base href="{SERVER}/wiki/"/><title>{escape(title)}</title>'
+        f'<link rel="stylesheet" href="/w/load.php?lang=en&amp;modules=mediawiki.skinning.content.parsoid&amp;only=styles"/>'
+        f'</head><body id="mwAA" class="mw-content-{direction} sitedir-{direction} {direction} '
+        f'mw-body-content parsoid-body mediawiki mw-parser-output" dir="{direction}">{body}</body></html>'
+    )
+
+
+def redirects(rng: random.Random, title: str, titles: List[str]) -> List[dict]:
+    names = []
+    for _ in range(rng.choice((0, 0, 0, 1, 1, 2, 3, 5))):
+        r = rng.random()
+        if r < 0.3:
+            name = title.lower()
+        elif r < 0.4 and titles:
+            # alias that is title of another article
+            name = rng.choice(titles)
+        elif r < 0.5 and names:
+            name = names[-1]
+        else:
+            name = f"{title} ({rng.choice(WORDS)})"
+        names.append(name)
+    return [{"name": name, "url": f"https:{SERVER}/wiki/{name}"} for name in names]
+
+
+def article_kind(rng: random.Random) -> str:
+    names = list(KINDS)
+    return rng.choices(names, weights=[KINDS[name][0] for name in names])[0]
+
+
+def article_html(kind_name: str, title: str, rng: random.Random, rtl: bool = False) -> str:
+    """Full page HTML of given article class."""
+    return page_html(title, KINDS[kind_name][1](Writer(rng, rtl)), rtl=rtl)
+
+
+def siteinfo(rtl: bool = False) -> dict:
+    general = {
+        "sitename": "Benchpedia",
+        "lang": "he" if rtl else "en",
+        "articlepath": "/wiki/$1",
+        "server": SERVER,
+    }
+    if rtl:
+        general["rtl"] = ""
+    return {
+        "general": general,
+        "rightsinfo": {
+            "text": "Creative Commons Attribution-Share Alike 4.0",
+            "url": "https://creativecommons.org/licenses/by-sa/4.0/",
+        },
+        "namespaces": {
+            "0": {"id": 0, "case": "first-letter", "*": "", "content": ""},
+            "6": {"id": 6, "case": "first-letter", "*": "File", "canonical": "File"},
+            "14": {"id": 14, "case": "first-letter", "*": "Category", "canonical": "Category"},
+        },
+        "interwikimap": [
+            {"prefix": "wikt", "url": "https://en.wiktionary.org/wiki/$1"},
+            {"prefix": "commons", "url": "https://commons.wikimedia.org/wiki/$1"},
+        ],
+    }
+
+
+def generate(
+    outdir: str,
+    articles: int = 2000,
+    files: int = 2,
+    seed: int = 0,
+    rtl: bool = False,
+    name: str = "benchwiki",
+) -> Tuple[str, str, Dict[str, int]]:
+    """
+    Write dump and siteinfo, return their paths and number of
+    articles of each class.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    rng = random.Random(seed)
+    dump_path = os.path.join(outdir, f"{name}-NS0-ENTERPRISE-HTML.json.tar.gz")
+    siteinfo_path = os.path.join(outdir, f"{name}.si.json")
+    with open(siteinfo_path, "w") as f:
+        json.dump(siteinfo(rtl), f, indent=2)
+    counts: Dict[str, int] = {k: 0 for k in KINDS}
+    titles: List[str] = []
+    per_file = -(-articles // files)
+    with tarfile.open(dump_path, "w:gz") as tar:
+        for file_number in range(files):
+            out = io.BytesIO()
+            for i in range(file_number * per_file, min(articles, (file_number + 1) * per_file)):
+                kind_name = article_kind(rng)
+                counts[kind_name] += 1
+                words = RTL_WORDS if rtl else WORDS
+                title = f"{rng.choice(words).capitalize()} {rng.choice(words)} {i}"
+                record = {
+                    "name": title,
+                    "identifier": i + 1,
+                    "url": f"https:{SERVER}/wiki/{title.replace(' ', '_')}",
+                    "namespace": {"identifier": 0},
+                    "article_body": {"html": article_html(kind_name, title, rng, rtl)},
+                    "redirects": redirects(rng, title, titles),
+                }
+                titles.append(title)
+                out.write(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+                out.write(b"\n")
+            info = tarfile.TarInfo(f"{name}_{file_number}.ndjson")
+            info.size = out.tell()
+            out.seek(0)
+            tar.addfile(info, out)
+    return dump_path, siteinfo_path, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("outdir")
+    parser.add_argument("-n", "--articles", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=2, help="NDJSON files in tarball")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rtl", action="store_true", help="Right-to-left wiki")
+    parser.add_argument("--name", default="benchwiki")
+    args = parser.parse_args()
+    dump_path, siteinfo_path, counts = generate(
+        args.outdir,
+        articles=args.articles,
+        files=args.files,
+        seed=args.seed,
+        rtl=args.rtl,
+        name=args.name,
+    )
+    print(dump_path)
+    print(siteinfo_path)
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Golden output regression check for article conversion.
+
+    python benchmarks/golden.py record golden.json.gz
+    python benchmarks/golden.py check golden.json.gz [--fast] [--minify] ...
+
+record converts a fixed corpus (generated, see gendump.py, or first
+articles of a dump given with --dump and --siteinfo) with given
+options and saves hash and normalized structure of each converted
+article. check converts same corpus, with same or different options,
+and prints structural diff for each article whose output differs.
+Exits with status 1 if any article differs.
+
+Normalized structure is one line per element (with sorted attributes)
+and per text node, with whitespace collapsed, so changes that don't
+affect document structure or text don't show up.
+"""
+import argparse
+import contextlib
+import difflib
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import random
+import re
+import sys
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+import gendump
+import lxml.html
+from run import load_filters
+
+from mw2slob import convert
+from mw2slob import core
+from mw2slob import dump
+from mw2slob import siteinfo as si
+
+WHITESPACE_RE = re.compile(r"[ \t\n\r\f]+")
+
+
+def collapse(text) -> str:
+    return WHITESPACE_RE.sub(" ", text).strip() if text else ""
+
+
+def normalize(html: bytes, encoding: str = "utf-8") -> str:
+    """
+    >>> print(normalize(b'<p b="2" a="1">x <i>y</i>  z</p>'))
+    <html>
+      <body>
+        <p a="1" b="2">
+          x
+          <i>
+            y
+          z
+    """
+    doc = lxml.html.document_fromstring(html.decode(encoding))
+    lines: List[str] = []
+
+    def walk(element, depth):
+        indent = "  " * depth
+        if isinstance(element.tag, str):
+            attrs = "".join(
+                f' {name}="{value}"' for name, value in sorted(element.attrib.items())
+            )
+            lines.append(f"{indent}<{element.tag}{attrs}>")
+            text = collapse(element.text)
+            if text:
+                lines.append(f"{indent}  {text}")
+            for child in element:
+                walk(child, depth + 1)
+        tail = collapse(element.tail)
+        if tail and depth:
+            lines.append(f"{indent}{tail}")
+
+    walk(doc, 0)
+    return "\n".join(lines)
+
+
+def digest(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def generated_corpus(
+    per_kind: int, seed: int
+) -> Tuple[si.Info, List[convert.ConvertParams]]:
+    corpus = []
+    infos = {}
+    for rtl in (False, True):
+        info = infos[rtl] = si.info(gendump.siteinfo(rtl))
+        for kind_name in gendump.KINDS:
+            rng = random.Random(f"golden-{seed}-{kind_name}-{rtl}")
+            for i in range(per_kind):
+                title = f"{kind_name}{' rtl' if rtl else ''} {i}"
+                corpus.append(
+                    convert.ConvertParams(
+                        title=title,
+                        aliases=(),
+                        text=gendump.article_html(kind_name, title, rng, rtl),
+                        rtl=info.rtl,
+                        server=info.server,
+                        articlepath="./",
+                        site_articlepath=info.articlepath,
+                        encoding="utf-8",
+                        remove_embedded_bg="",
+                        ensure_ext_image_urls=True,
+                    )
+                )
+    # generated sites differ only in direction, which each article carries
+    return infos[False], corpus
+
+
+def dump_corpus(
+    dump_file: str, siteinfo_file: str, limit: int
+) -> Tuple[si.Info, List[convert.ConvertParams]]:
+    with open(siteinfo_file) as f:
+        info = si.info(json.load(f))
+    with contextlib.redirect_stdout(io.StringIO()):
+        corpus = list(itertools.islice(dump.articles([dump_file], info), limit))
+    return info, corpus
+
+
+def corpus_for(source: dict) -> Tuple[si.Info, List[convert.ConvertParams]]:
+    if source.get("dump"):
+        return dump_corpus(source["dump"], source["siteinfo"], source["limit"])
+    return generated_corpus(source["per_kind"], source["seed"])
+
+
+def convert_corpus(
+    info: si.Info, corpus: Iterable[convert.ConvertParams], options: dict
+) -> Dict[str, str]:
+    """Normalized output of each article, by title"""
+    state = core.ConvertState(load_filters(), info.interwikimap, info.namespaces)
+    outputs = {}
+    for params in corpus:
+        params = params._replace(
+            minify=options["minify"],
+            remove_embedded_bg=options["remove_embedded_bg"],
+            ensure_ext_image_urls=options["ensure_ext_image_urls"],
+        )
+        try:
+            html = convert.convert(
+                params,
+                state.selectors,
+                state.namespaces,
+                state.interwiki,
+                fast=options["fast"],
+            )
+        except Exception as ex:
+            outputs[params.title] = f"!! {type(ex).__name__}: {ex}"
+        else:
+            outputs[params.title] = normalize(html, params.encoding)
+    return outputs
+
+
+def options_from_args(args) -> dict:
+    return {
+        "fast": args.fast,
+        "minify": args.minify,
+        "remove_embedded_bg": args.remove_embedded_bg,
+        "ensure_ext_image_urls": not args.no_ensure_ext_image_urls,
+    }
+
+
+def record(args):
+    source = {
+        "dump": args.dump,
+        "siteinfo": args.siteinfo,
+        "limit": args.limit,
+        "per_kind": args.per_kind,
+        "seed": args.seed,
+    }
+    options = options_from_args(args)
+    info, corpus = corpus_for(source)
+    outputs = convert_corpus(info, corpus, options)
+    golden = {
+        "source": source,
+        "options": options,
+        "articles": {
+            title: {"hash": digest(normalized), "normalized": normalized}
+            for title, normalized in outputs.items()
+        },
+    }
+    with gzip.open(args.golden, "wt", encoding="utf-8") as f:
+        json.dump(golden, f)
+    print(f"Recorded {len(outputs)} articles with {options}")
+
+
+def check(args) -> int:
+    with gzip.open(args.golden, "rt", encoding="utf-8") as f:
+        golden = json.load(f)
+    options = options_from_args(args)
+    info, corpus = corpus_for(golden["source"])
+    outputs = convert_corpus(info, corpus, options)
+    print(f"Reference options: {golden['options']}")
+    print(f"Checked options:   {options}")
+    reference = golden["articles"]
+    changed = 0
+    for title, normalized in outputs.items():
+        expected = reference.get(title)
+        if expected is None:
+            print(f"\n?? {title}: not in reference")
+            changed += 1
+            continue
+        if digest(normalized) == expected["hash"]:
+            continue
+        changed += 1
+        diff = list(
+            difflib.unified_diff(
+                expected["normalized"].splitlines(),
+                normalized.splitlines(),
+                fromfile=f"{title} (reference)",
+                tofile=f"{title} (checked)",
+                lineterm="",
+                n=args.context,
+            )
+        )
+        print()
+        print("\n".join(diff[: args.max_lines]))
+        if len(diff) > args.max_lines:
+            print(f"... {len(diff) - args.max_lines} more diff lines")
+    missing = set(reference) - set(outputs)
+    for title in sorted(missing):
+        print(f"\n?? {title}: missing in checked output")
+    changed += len(missing)
+    print(f"\n{changed} of {len(reference)} articles differ")
+    return 1 if changed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers()
+
+    options_parser = argparse.ArgumentParser(add_help=False)
+    options_parser.add_argument("golden", help="Golden output file (gzipped JSON)")
+    options_parser.add_argument(
+        "--fast", action="store_true", help="Use fast conversion (libxml2 parser)"
+    )
+    options_parser.add_argument("--minify", action="store_true")
+    options_parser.add_argument("--remove-embedded-bg", default="")
+    options_parser.add_argument("--no-ensure-ext-image-urls", action="store_true")
+
+    parser_record = subparsers.add_parser(
+        "record", parents=[options_parser], help="Save reference output"
+    )
+    parser_record.add_argument("--per-kind", type=int, default=5)
+    parser_record.add_argument("--seed", type=int, default=0)
+    parser_record.add_argument("--dump", help="Use articles from this dump file")
+    parser_record.add_argument("--siteinfo", help="Siteinfo for --dump")
+    parser_record.add_argument(
+        "--limit", type=int, default=200, help="Articles to take from --dump"
+    )
+    parser_record.set_defaults(func=record)
+
+    parser_check = subparsers.add_parser(
+        "check", parents=[options_parser], help="Compare output with reference"
+    )
+    parser_check.add_argument(
+        "--context", type=int, default=2, help="Diff context lines"
+    )
+    parser_check.add_argument(
+        "--max-lines", type=int, default=60, help="Diff lines shown per article"
+    )
+    parser_check.set_defaults(func=check)
+
+    args = parser.parse_args()
+    if not hasattr(args, "func"):
+        parser.print_help()
+        return
+    if args.func is record and bool(args.dump) != bool(args.siteinfo):
+        parser.error("--dump and --siteinfo go together")
+    sys.exit(args.func(args) or 0)
+
+
+if __name__ == "__main__":
+    main()
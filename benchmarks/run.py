@@ -0,0 +1,268 @@
+"""
+Run mw2slob benchmarks and save results as JSON.
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/compare.py before.json results.json
+
+Benchmarks:
+
+convert      convert.convert time per article class (see gendump.KINDS)
+read         dump.articles reading throughput
+create_slob  end-to-end core.create_slob articles per second, for each
+             --executor given (compare process and thread executors with
+             --executor process thread)
+
+Synthetic dump is generated in work directory (or reused if it's
+already there) with fixed seed, so results from different commits
+are comparable as long as article count and seed are the same.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+
+import gendump
+
+from mw2slob import convert
+from mw2slob import core
+from mw2slob import dump
+from mw2slob import siteinfo as si
+
+BENCHMARKS = ("convert", "read", "create_slob")
+
+FILTERS = ("common", "wiki")
+
+
+def load_filters(names=FILTERS) -> List[str]:
+    filter_dir = os.path.join(os.path.dirname(convert.__file__), "filters")
+    filters = []
+    for name in names:
+        with open(os.path.join(filter_dir, name)) as f:
+            filters.extend(line.strip() for line in f if line.strip())
+    return filters
+
+
+def timed(f: Callable, repeat: int) -> float:
+    """Best time of several runs, seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def quiet():
+    # dump.articles and create_slob print progress for each article
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def bench_convert(info: si.Info, per_kind: int, repeat: int, seed: int, rtl: bool):
+    state = core.ConvertState(load_filters(), info.interwikimap, info.namespaces)
+    results = {}
+    for kind_name in gendump.KINDS:
+        rng = random.Random(f"{seed}-{kind_name}")
+        articles = [
+            convert.ConvertParams(
+                title=f"{kind_name} {i}",
+                aliases=(),
+                text=gendump.article_html(kind_name, f"{kind_name} {i}", rng, rtl),
+                rtl=info.rtl,
+                server=info.server,
+                articlepath="./",
+                site_articlepath=info.articlepath,
+                encoding="utf-8",
+                remove_embedded_bg="",
+                ensure_ext_image_urls=True,
+            )
+            for i in range(per_kind)
+        ]
+        size = sum(len(params.text) for params in articles)
+
+        def run():
+            for params in articles:
+                convert.convert(
+                    params, state.selectors, state.namespaces, state.interwiki
+                )
+
+        seconds = timed(run, repeat)
+        results[kind_name] = {
+            "articles": per_kind,
+            "input_bytes": size,
+            "seconds": seconds,
+            "ms_per_article": seconds / per_kind * 1000,
+            "mb_per_s": size / seconds / 1e6,
+        }
+        print(
+            f"convert {kind_name:10} {seconds / per_kind * 1000:9.2f} ms/article "
+            f"{size / seconds / 1e6:7.2f} MB/s",
+            file=sys.stderr,
+        )
+    return results
+
+
+def bench_read(dump_path: str, info: si.Info, repeat: int):
+    count = 0
+    size = 0
+
+    def run():
+        nonlocal count, size
+        count = size = 0
+        with quiet():
+            for params in dump.articles([dump_path], info):
+                count += 1
+                size += len(params.text)
+
+    seconds = timed(run, repeat)
+    print(
+        f"read {count / seconds:12.1f} articles/s {size / seconds / 1e6:7.2f} MB/s",
+        file=sys.stderr,
+    )
+    return {
+        "articles": count,
+        "input_bytes": size,
+        "seconds": seconds,
+        "articles_per_s": count / seconds,
+        "mb_per_s": size / seconds / 1e6,
+    }
+
+
+def bench_create_slob(
+    dump_path: str, info: si.Info, workdir: str, articles: int, executor: str
+):
+    outname = os.path.join(workdir, "bench.slob")
+    if os.path.exists(outname):
+        os.remove(outname)
+    t0 = time.perf_counter()
+    with quiet():
+        core.create_slob(
+            outname,
+            info,
+            dump.articles([dump_path], info),
+            workdir=workdir,
+            filters=load_filters(),
+            observer=lambda e: None,
+            executor=executor,
+        )
+    seconds = time.perf_counter() - t0
+    size = os.path.getsize(outname)
+    os.remove(outname)
+    print(
+        f"create_slob {executor:8} {articles / seconds:9.1f} articles/s",
+        file=sys.stderr,
+    )
+    return {
+        "articles": articles,
+        "seconds": seconds,
+        "articles_per_s": articles / seconds,
+        "slob_bytes": size,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", help="Save results to this JSON file")
+    parser.add_argument(
+        "-w", "--workdir", help="Directory for generated dump. Default: temporary"
+    )
+    parser.add_argument(
+        "-n", "--articles", type=int, default=2000, help="Articles in generated dump"
+    )
+    parser.add_argument(
+        "--per-kind", type=int, default=20, help="Articles of each class to convert"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rtl", action="store_true", help="Right-to-left wiki")
+    parser.add_argument(
+        "--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, metavar="NAME"
+    )
+    parser.add_argument(
+        "--executor",
+        nargs="+",
+        choices=core.EXECUTORS,
+        default=[core.Defaults.executor],
+        help="Run create_slob benchmark with each of these executors",
+    )
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory())
+        name = f"bench-{args.articles}-{args.seed}{'-rtl' if args.rtl else ''}"
+        dump_path = os.path.join(workdir, f"{name}-NS0-ENTERPRISE-HTML.json.tar.gz")
+        siteinfo_path = os.path.join(workdir, f"{name}.si.json")
+        if not (os.path.exists(dump_path) and os.path.exists(siteinfo_path)):
+            print(f"Generating {dump_path}", file=sys.stderr)
+            gendump.generate(
+                workdir, articles=args.articles, seed=args.seed, rtl=args.rtl, name=name
+            )
+        with open(siteinfo_path) as f:
+            info = si.info(json.load(f))
+
+        results: Dict[str, dict] = {}
+        if "convert" in args.only:
+            results["convert"] = bench_convert(
+                info, args.per_kind, args.repeat, args.seed, args.rtl
+            )
+        if "read" in args.only:
+            results["read"] = bench_read(dump_path, info, args.repeat)
+        if "create_slob" in args.only:
+            results["create_slob"] = {
+                executor: bench_create_slob(
+                    dump_path, info, workdir, args.articles, executor
+                )
+                for executor in args.executor
+            }
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        # thread executor only converts in parallel without GIL
+        "gil": getattr(sys, "_is_gil_enabled", lambda: True)(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "articles": args.articles,
+            "per_kind": args.per_kind,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "rtl": args.rtl,
+            "executors": args.executor,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+from .core import stream
+
+__all__ = ["stream"]
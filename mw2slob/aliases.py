@@ -0,0 +1,75 @@
+import logging
+from typing import Hashable
+from typing import Iterable
+from typing import List
+from typing import Set
+
+log = logging.getLogger(__name__)
+
+
+class AliasIndex:
+    """
+    Tracks keys added to slob so that each article's aliases can be
+    reduced to those that actually add something before they are handed
+    to slob with article, which then has fewer keys to sort and resolve.
+
+    Aliases same as article's own title ignoring case, already added
+    (for this or another article) or same as title of an article added
+    earlier are dropped. Articles must be added in input order (see
+    ordered in core.convert_all) for result not to depend on which
+    conversion finishes first.
+
+    >>> index = AliasIndex()
+    >>> index.keys("Abc", ["abc", "Abc", "ABC", "Abcd", "Abcd", "Xyz"])
+    ['Abc', 'Abcd', 'Xyz']
+    >>> index.keys("Xyz", ["Abcd", "Abc", "Xyz2", ("Abc", "section")])
+    ['Xyz', 'Xyz2', ('Abc', 'section')]
+    >>> index.self_aliases, index.duplicates, index.collisions, index.late_collisions
+    (3, 2, 1, 1)
+    >>> index.added
+    4
+    """
+
+    def __init__(self):
+        self.titles: Set[str] = set()
+        self.aliases: Set[Hashable] = set()
+        # aliases same as article's own title, or differing only by case
+        # (slob lookup finds these anyway)
+        self.self_aliases = 0
+        # aliases repeated in article or already added for another article
+        self.duplicates = 0
+        # aliases matching title of another article
+        self.collisions = 0
+        # titles matching alias of another article added earlier
+        self.late_collisions = 0
+        self.added = 0
+
+    def keys(self, title: str, aliases: Iterable[Hashable]) -> List[Hashable]:
+        if title in self.aliases:
+            self.late_collisions += 1
+            log.debug("Title %r was already added as alias", title)
+        self.titles.add(title)
+        keys: List[Hashable] = [title]
+        folded_title = title.casefold()
+        for alias in aliases or ():
+            if isinstance(alias, str) and alias.casefold() == folded_title:
+                self.self_aliases += 1
+                continue
+            if alias in self.aliases:
+                self.duplicates += 1
+                continue
+            if alias in self.titles:
+                self.collisions += 1
+                log.debug("Alias %r of %r is title of another article", alias, title)
+                continue
+            self.aliases.add(alias)
+            self.added += 1
+            keys.append(alias)
+        return keys
+
+    def summary(self) -> str:
+        return (
+            f"Added {self.added} aliases, dropped {self.self_aliases} self aliases, "
+            f"{self.duplicates} duplicates, {self.collisions} colliding with titles "
+            f"({self.late_collisions} titles collided with aliases added earlier)"
+        )
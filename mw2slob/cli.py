@@ -5,10 +5,18 @@ import json
 import logging
 import os
 
+from . import compressionreport
 from . import core
+from . import distributed
+from . import dryrun
 from . import dump
+from . import filterprofile
+from . import metrics
+from . import progress
+from . import quarantine
 from . import scrape
 from . import siteinfo
+from . import sizereport
 
 
 def cli_siteinfo(args):
@@ -62,21 +70,61 @@ def get_filters(args):
     return filters
 
 
-def run(outname, info, articles, args):
+def get_progress(args, position=None):
+    if not (args.progress_log or args.metrics_port):
+        return None
+    return progress.Progress(
+        progress.open_log(args.progress_log) if args.progress_log else None,
+        args.progress_interval,
+        position,
+    )
+
+
+def run(outname, info, articles, args, filters=None, converted=None, position=None):
     tags = get_tags(args, info)
-    filters = get_filters(args)
-    core.create_slob(
-        outname,
-        info,
+    if filters is None:
+        filters = get_filters(args)
+    build_progress = get_progress(args, position)
+    with metrics.serve(build_progress, args.metrics_port, args.metrics_host):
+        core.create_slob(
+            outname,
+            info,
+            articles,
+            content_dirs=args.content_dirs,
+            compression=args.compression,
+            workdir=args.workdir,
+            min_bin_size=args.bin_size,
+            no_math=args.no_math,
+            html_encoding=args.html_encoding,
+            tags=tags,
+            filters=filters,
+            converted=converted,
+            dedupe_aliases=args.dedupe_aliases,
+            dedupe_content=args.dedupe_content,
+            prune_css=args.prune_css,
+            time_budget=args.time_budget,
+            executor=args.executor,
+            shared_memory=args.shared_memory * 1024 * 1024,
+            stage_times=args.stage_times,
+            profile_dir=args.profile,
+            verbose=not args.quiet,
+            progress=build_progress,
+            quarantine_file=args.quarantine,
+        )
+
+
+def dry_run(info, articles, args):
+    dryrun.dry_run(
         articles,
-        content_dirs=args.content_dirs,
-        compression=args.compression,
-        workdir=args.workdir,
+        info,
+        filters=get_filters(args),
+        sample_size=args.sample,
+        time_budget=args.time_budget,
+        executor=args.executor,
         min_bin_size=args.bin_size,
-        no_math=args.no_math,
-        html_encoding=args.html_encoding,
-        tags=tags,
-        filters=filters,
+        dedupe_aliases=args.dedupe_aliases,
+        dedupe_content=args.dedupe_content,
+        seed=args.seed,
     )
 
 
@@ -97,7 +145,19 @@ def cli_dump(args):
                 couch_urls.append(name)
         else:
             dump_files.append(name)
+    if args.distribute and not args.dry_run:
+        if couch_urls:
+            raise SystemExit("CouchDB input can't be used with --distribute")
+        if args.start_line != "1:1" or args.end_line:
+            raise SystemExit(
+                "--start-line and --end-line can't be used with --distribute"
+            )
+        cli_dump_distributed(outname, info, siteinfo_dict, dump_files, args)
+        return
     scrape_articles = [scrape.articles(couch_url, info) for couch_url in couch_urls]
+    # progress of reading dump files can only tell time left
+    # if there's nothing else to read
+    position = None if couch_urls else dump.ReadPosition(dump_files)
     dump_articles = dump.articles(
         dump_files,
         info,
@@ -106,8 +166,192 @@ def cli_dump(args):
         html_encoding=args.html_encoding,
         remove_embedded_bg=args.remove_embedded_bg,
         ensure_ext_image_urls=args.ensure_ext_image_urls,
+        minify=args.minify,
+        verbose=not args.quiet,
+        position=position,
+    )
+    if args.dry_run:
+        dry_run(info, itertools.chain(*scrape_articles, dump_articles), args)
+        return
+    run(
+        outname,
+        info,
+        itertools.chain(*scrape_articles, dump_articles),
+        args,
+        position=position,
+    )
+
+
+def cli_size_report(args):
+    siteinfo_dict = dump.get_siteinfo(args)
+    info = siteinfo.info(siteinfo_dict, args.local_namespaces)
+    articles = dump.articles(
+        args.dump_file,
+        info,
+        start_line_spec=args.start_line,
+        html_encoding=args.html_encoding,
+        remove_embedded_bg=args.remove_embedded_bg,
+        ensure_ext_image_urls=args.ensure_ext_image_urls,
+    )
+    report = sizereport.size_report(
+        itertools.islice(articles, args.sample),
+        get_filters(args),
+        info.interwikimap,
+        info.namespaces,
+        bin_size=args.bin_size * 1024,
+    )
+    sizereport.print_report(report)
+
+
+def cli_compression_report(args):
+    def sample(items):
+        if args.first:
+            return itertools.islice(items, args.sample)
+        return dryrun.random_sample(items, args.sample, args.seed)
+
+    if args.converted:
+        results = list(sample(distributed.read_spills(args.converted)))
+    else:
+        if not args.dump_file:
+            raise SystemExit("No input, give dump files or --converted")
+        siteinfo_dict = dump.get_siteinfo(args)
+        info = siteinfo.info(siteinfo_dict, args.local_namespaces)
+        articles = dump.articles(
+            args.dump_file,
+            info,
+            start_line_spec=args.start_line,
+            html_encoding=args.html_encoding,
+            remove_embedded_bg=args.remove_embedded_bg,
+            ensure_ext_image_urls=args.ensure_ext_image_urls,
+            minify=args.minify,
+            verbose=False,
+        )
+        results = list(
+            core.convert_all(
+                sample(articles),
+                get_filters(args),
+                info.interwikimap,
+                info.namespaces,
+                time_budget=args.time_budget,
+            )
+        )
+    if args.save_converted:
+        count = distributed.write_spill(args.save_converted, results)
+        print(f"Saved {count} converted articles to {args.save_converted}")
+    report = compressionreport.compression_report(
+        (html for _, _, html, _ in results if html),
+        codecs=args.codecs,
+        bin_sizes=args.bin_sizes,
+        lookups=args.lookups,
+        seed=args.seed,
+    )
+    compressionreport.print_report(report, (args.compression, args.bin_size))
+
+
+def cli_profile_filters(args):
+    filters = get_filters(args)
+    if not filters:
+        raise SystemExit("No filters to profile, see --filter-file and --filter")
+    siteinfo_dict = dump.get_siteinfo(args)
+    info = siteinfo.info(siteinfo_dict, args.local_namespaces)
+    articles = list(
+        itertools.islice(
+            dump.articles(
+                args.dump_file,
+                info,
+                start_line_spec=args.start_line,
+                html_encoding=args.html_encoding,
+            ),
+            args.sample,
+        )
+    )
+    stats = filterprofile.profile_filters(articles, filters)
+    filterprofile.print_report(stats, len(articles), sort=args.sort)
+
+
+def cli_replay(args):
+    with open(args.siteinfo) as siteinfo_file:
+        info = siteinfo.info(json.load(siteinfo_file), args.local_namespaces)
+    articles = []
+    for record in quarantine.read(args.quarantine_file):
+        params = quarantine.to_params(record)
+        if params is None:
+            print(f"? {record['title']}: article wasn't saved")
+        else:
+            articles.append(params)
+    if args.output_file:
+        run(args.output_file, info, articles, args)
+        return
+    state = core.ConvertState(
+        get_filters(args), info.interwikimap, info.namespaces, args.time_budget
+    )
+    converted = 0
+    for params in articles:
+        title, _, html, error = core.safe_convert(params, state)
+        if error:
+            print(f"F {title}: {error}")
+        else:
+            converted += 1
+            print(f"S {title} ({len(html)})")
+    print(f"Converted {converted} of {len(articles)} articles")
+
+
+def get_authkey(args):
+    authkey = args.authkey or os.environ.get("MW2SLOB_AUTHKEY")
+    return authkey.encode() if authkey else None
+
+
+def cli_dump_distributed(outname, info, siteinfo_dict, dump_files, args):
+    filters = get_filters(args)
+    job = {
+        "dump_files": [os.path.abspath(os.path.expanduser(f)) for f in dump_files],
+        "siteinfo": siteinfo_dict,
+        "local_namespaces": args.local_namespaces,
+        "filters": filters,
+        "html_encoding": args.html_encoding,
+        "remove_embedded_bg": args.remove_embedded_bg,
+        "ensure_ext_image_urls": args.ensure_ext_image_urls,
+        "minify": args.minify,
+        "time_budget": args.time_budget,
+    }
+    spill_dir = args.spill_dir
+    if not spill_dir:
+        spill_dir = os.path.join(args.workdir, os.path.basename(outname) + ".spill")
+    spill_paths = distributed.coordinate(
+        distributed.parse_address(args.distribute),
+        get_authkey(args),
+        job,
+        spill_dir,
+        range_size=args.range_size * 1024 * 1024 if args.range_size else None,
+        local_workers=args.local_workers,
+        executor=args.executor,
+        shared_memory=args.shared_memory * 1024 * 1024,
+        lease_timeout=args.lease_timeout,
+    )
+    run(
+        outname,
+        info,
+        (),
+        args,
+        filters=filters,
+        converted=distributed.read_spills(spill_paths),
+    )
+    distributed.remove_spill_dir(spill_dir)
+
+
+def cli_worker(args):
+    authkey = get_authkey(args)
+    if not authkey:
+        raise SystemExit("Authentication key is required, see --authkey")
+    distributed.work(
+        distributed.parse_address(args.address),
+        authkey,
+        workdir=args.workdir,
+        processes=args.processes,
+        dump_dir=args.dump_dir,
+        executor=args.executor,
+        shared_memory=args.shared_memory * 1024 * 1024,
     )
-    run(outname, info, itertools.chain(*scrape_articles, dump_articles), args)
 
 
 def cli_scrape(args):
@@ -125,7 +369,11 @@ def cli_scrape(args):
         html_encoding=args.html_encoding,
         remove_embedded_bg=args.remove_embedded_bg,
         ensure_ext_image_urls=args.ensure_ext_image_urls,
+        minify=args.minify,
     )
+    if args.dry_run:
+        dry_run(info, articles, args)
+        return
     run(outname, info, articles, args)
 
 
@@ -150,7 +398,37 @@ def arg_parser():
     parser_siteinfo.add_argument("--api-path", default="/w/api.php")
     parser_siteinfo.set_defaults(func=cli_siteinfo)
 
-    base_parser = argparse.ArgumentParser(add_help=False)
+    # conversion options shared by commands converting dumps and worker
+    executor_parser = argparse.ArgumentParser(add_help=False)
+
+    executor_parser.add_argument(
+        "--executor",
+        choices=core.EXECUTORS,
+        default=core.Defaults.executor,
+        help=(
+            "Run conversions in worker processes or in threads. Threads "
+            "avoid sending article text between processes, but only convert "
+            "in parallel on free-threaded Python, and don't enforce time "
+            "budget. Default: %(default)s"
+        ),
+    )
+
+    executor_parser.add_argument(
+        "--shared-memory",
+        type=int,
+        default=core.Defaults.shared_memory,
+        metavar="MB",
+        help=(
+            "Pass article text to worker processes and converted HTML back "
+            "through shared memory buffers of this size in megabytes instead "
+            "of pipes. Two buffers are allocated for each batch of articles "
+            "in flight (twice the number of processes). Articles that don't "
+            "fit go through pipes. 0 means don't use shared memory. "
+            "Default: %(default)s"
+        ),
+    )
+
+    base_parser = argparse.ArgumentParser(add_help=False, parents=[executor_parser])
 
     base_parser.add_argument(
         "-o", "--output-file", type=str, help="Name of output slob file"
@@ -306,6 +584,108 @@ def arg_parser():
         help=("Convert internal image URLs to external URLs"),
     )
 
+    base_parser.add_argument(
+        "--minify",
+        action="store_true",
+        help=(
+            "Minify article HTML: collapse whitespace, remove empty "
+            "wrapper elements and attributes article reader doesn't use"
+        ),
+    )
+
+    base_parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=core.Defaults.time_budget,
+        help=(
+            "Seconds article conversion may take. Articles that take longer "
+            "are converted again skipping expensive steps, or, if that "
+            "takes too long too, replaced with a link to online version. "
+            "0 means no limit. Default: %(default)s"
+        ),
+    )
+
+    base_parser.add_argument(
+        "--stage-times",
+        action="store_true",
+        help=(
+            "Measure time each article conversion stage (parsing, cleaning, "
+            "filters, link rewriting, serialization etc.) takes and report "
+            "totals, percentiles and slowest articles for each stage at the end"
+        ),
+    )
+
+    base_parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help=(
+            "Profile conversion with cProfile in this process and in each "
+            "worker and save stats of each process as well as merged stats "
+            "(merged.prof) and text report of most expensive functions "
+            "(report.txt) to this directory. Profiling slows conversion down"
+        ),
+    )
+
+    base_parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Don't print a line for each article read and added",
+    )
+
+    base_parser.add_argument(
+        "--progress-log",
+        metavar="FILE",
+        help=(
+            "Append progress records to this file as JSON lines: articles "
+            "read, stored, failed, empty and duplicate, input and output "
+            "size, rates, batches waiting for conversion, memory used by "
+            "this process and by workers, estimated time left (when "
+            "converting dump files) and slob finalization phases. "
+            "- means standard error"
+        ),
+    )
+
+    base_parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=progress.INTERVAL,
+        metavar="SECONDS",
+        help="Seconds between progress records. Default: %(default)s",
+    )
+
+    base_parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help=(
+            "Serve build metrics in Prometheus text format at "
+            "http://HOST:PORT/metrics: articles converted, failed and empty, "
+            "input and output size, conversion time histogram, articles in "
+            "flight, current slob creation phase and time spent in each phase"
+        ),
+    )
+
+    base_parser.add_argument(
+        "--metrics-host",
+        default="127.0.0.1",
+        metavar="HOST",
+        help=(
+            "Address to serve metrics at, see --metrics-port. "
+            "Default: %(default)s"
+        ),
+    )
+
+    base_parser.add_argument(
+        "--quarantine",
+        metavar="FILE",
+        help=(
+            "Append articles that failed to convert to this file (gzipped "
+            "JSON lines with title, source location, error, traceback and "
+            "article HTML), see replay command"
+        ),
+    )
+
     base_parser.add_argument(
         "--no-math",
         action="store_true",
@@ -315,15 +695,40 @@ def arg_parser():
         ),
     )
 
-    parser_dump = subparsers.add_parser(
-        "dump", parents=[base_parser], help="Convert HTML dump"
+    base_parser.add_argument(
+        "--dedupe-aliases",
+        action="store_true",
+        help=(
+            "Drop aliases same as article title (ignoring case), already "
+            "added or same as title of an article added earlier, instead of "
+            "adding all redirects as article keys as is. Articles are then "
+            "added in dump order, so that result is the same in every run"
+        ),
     )
 
-    parser_dump.add_argument(
-        "dump_file", nargs="+", type=str, help="Process data from dump file"
+    base_parser.add_argument(
+        "--dedupe-content",
+        action="store_true",
+        help=(
+            "Store articles with converted content identical to that of "
+            "an article added earlier, such as same article repeated in "
+            "dump, as aliases of that article (keeps content digest for "
+            "every article in memory)"
+        ),
     )
 
-    parser_dump.add_argument(
+    base_parser.add_argument(
+        "--prune-css",
+        action="store_true",
+        help=(
+            "Leave out rules of bundled MediaWiki stylesheets that can't "
+            "match anything in converted articles"
+        ),
+    )
+
+    siteinfo_parser = argparse.ArgumentParser(add_help=False)
+
+    siteinfo_parser.add_argument(
         "--siteinfo",
         type=str,
         help=(
@@ -332,6 +737,66 @@ def arg_parser():
         ),
     )
 
+    # options of commands working with sample of dump articles
+    sample_parser = argparse.ArgumentParser(
+        add_help=False, parents=[siteinfo_parser]
+    )
+
+    sample_parser.add_argument(
+        "-s",
+        "--start-line",
+        type=str,
+        default="1:1",
+        help="Start spec: start reading sample at this file:line",
+    )
+
+    sample_parser.add_argument(
+        "-n",
+        "--sample",
+        type=int,
+        default=1000,
+        help="Number of sample articles. Default: %(default)s",
+    )
+
+    dry_run_parser = argparse.ArgumentParser(add_help=False)
+
+    dry_run_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help=(
+            "Read all articles and convert random sample of them without "
+            "creating slob, then report projected conversion time, output size "
+            "for each compression and memory needed"
+        ),
+    )
+
+    dry_run_parser.add_argument(
+        "--sample",
+        type=int,
+        default=1000,
+        help=(
+            "Number of articles to convert with --dry-run, sampled across "
+            "article sizes. Default: %(default)s"
+        ),
+    )
+
+    dry_run_parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed for --dry-run sample, to get the same sample again",
+    )
+
+    parser_dump = subparsers.add_parser(
+        "dump",
+        parents=[base_parser, siteinfo_parser, dry_run_parser],
+        help="Convert HTML dump",
+    )
+
+    parser_dump.add_argument(
+        "dump_file", nargs="+", type=str, help="Process data from dump file"
+    )
+
     parser_dump.add_argument(
         "-s",
         "--start-line",
@@ -348,10 +813,250 @@ def arg_parser():
         help="End spec: processing dump at this file:line",
     )
 
+    parser_dump.add_argument(
+        "--distribute",
+        metavar="HOST:PORT",
+        help=(
+            "Listen for workers (see worker command) at this address and "
+            "distribute conversion of dump ranges to them"
+        ),
+    )
+
+    parser_dump.add_argument(
+        "--range-size",
+        type=int,
+        default=None,
+        metavar="MB",
+        help=(
+            "Size of each range handed out to a worker, in megabytes of "
+            "uncompressed dump. Default: one range per file in dump"
+        ),
+    )
+
+    parser_dump.add_argument(
+        "--lease-timeout",
+        type=int,
+        default=distributed.LEASE_TIMEOUT,
+        metavar="SECONDS",
+        help=(
+            "Hand range out to another worker if worker converting it "
+            "doesn't report progress for this long. Default: %(default)s"
+        ),
+    )
+
+    parser_dump.add_argument(
+        "--local-workers",
+        type=int,
+        default=0,
+        help="Number of workers to also start on this machine. Default: %(default)s",
+    )
+
+    parser_dump.add_argument(
+        "--spill-dir",
+        type=str,
+        help=(
+            "Directory for converted ranges received from workers. "
+            "Ranges already there from an interrupted run are not converted again. "
+            "Default: output file name with .spill extension in work directory"
+        ),
+    )
+
+    parser_dump.add_argument(
+        "--authkey",
+        type=str,
+        help=(
+            "Key workers use to authenticate. "
+            "Default: value of MW2SLOB_AUTHKEY environment variable or random key"
+        ),
+    )
+
     parser_dump.set_defaults(func=cli_dump)
 
+    parser_size_report = subparsers.add_parser(
+        "size-report",
+        parents=[base_parser, sample_parser],
+        help="Compare converted article sizes with and without --minify",
+    )
+
+    parser_size_report.add_argument(
+        "dump_file", nargs="+", type=str, help="Read sample articles from dump file"
+    )
+
+    parser_size_report.set_defaults(func=cli_size_report)
+
+    parser_compression_report = subparsers.add_parser(
+        "compression-report",
+        parents=[base_parser, sample_parser],
+        help=(
+            "Measure output size, compression time and random article "
+            "lookup time for each compression and bin size"
+        ),
+    )
+
+    parser_compression_report.add_argument(
+        "dump_file", nargs="*", type=str, help="Read sample articles from dump file"
+    )
+
+    parser_compression_report.add_argument(
+        "--first",
+        action="store_true",
+        help=(
+            "Measure first --sample articles instead of random sample, "
+            "without reading all input (sizes are then biased towards "
+            "whatever comes first)"
+        ),
+    )
+
+    parser_compression_report.add_argument(
+        "--converted",
+        nargs="+",
+        metavar="FILE",
+        help=(
+            "Read already converted articles from these files (saved with "
+            "--save-converted or spill files of dump --distribute) instead of "
+            "converting dump articles"
+        ),
+    )
+
+    parser_compression_report.add_argument(
+        "--save-converted",
+        metavar="FILE",
+        help="Save converted sample articles to this file for later runs",
+    )
+
+    parser_compression_report.add_argument(
+        "--codecs",
+        nargs="+",
+        choices=compressionreport.CODECS,
+        default=list(compressionreport.CODECS),
+        help="Compressions to measure. Default: all",
+    )
+
+    parser_compression_report.add_argument(
+        "--bin-sizes",
+        nargs="+",
+        type=int,
+        default=list(compressionreport.BIN_SIZES),
+        metavar="KB",
+        help="Minimum bin sizes to measure, in kilobytes. Default: %(default)s",
+    )
+
+    parser_compression_report.add_argument(
+        "--lookups",
+        type=int,
+        default=200,
+        help=(
+            "Number of random articles to look up with each setting. "
+            "Default: %(default)s"
+        ),
+    )
+
+    parser_compression_report.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed for choosing sample and articles to look up",
+    )
+
+    parser_compression_report.set_defaults(func=cli_compression_report)
+
+    parser_profile_filters = subparsers.add_parser(
+        "profile-filters",
+        parents=[base_parser, sample_parser],
+        help=(
+            "Report time, matches and removed bytes for each filter selector "
+            "applied to sample articles"
+        ),
+    )
+
+    parser_profile_filters.add_argument(
+        "dump_file", nargs="+", type=str, help="Read sample articles from dump file"
+    )
+
+    parser_profile_filters.add_argument(
+        "--sort",
+        choices=list(filterprofile.SORT_KEYS),
+        default="time",
+        help=(
+            "Order selectors by total time, matches, removed bytes "
+            "or list them in filter order. Default: %(default)s"
+        ),
+    )
+
+    parser_profile_filters.set_defaults(func=cli_profile_filters)
+
+    parser_replay = subparsers.add_parser(
+        "replay",
+        parents=[base_parser],
+        help=(
+            "Convert articles saved with --quarantine again, "
+            "to check them or to create supplementary slob (with -o)"
+        ),
+    )
+
+    parser_replay.add_argument(
+        "quarantine_file", help="File failed articles were saved to"
+    )
+
+    parser_replay.add_argument(
+        "--siteinfo",
+        type=str,
+        required=True,
+        help="Path to Mediawiki siteinfo JSON file of the dump articles came from",
+    )
+
+    parser_replay.set_defaults(func=cli_replay)
+
+    parser_worker = subparsers.add_parser(
+        "worker",
+        parents=[executor_parser],
+        help="Convert dump ranges for dump --distribute coordinator",
+    )
+
+    parser_worker.add_argument(
+        "address", metavar="HOST:PORT", help="Address of coordinator"
+    )
+
+    parser_worker.add_argument(
+        "--authkey",
+        type=str,
+        help=(
+            "Key to authenticate with coordinator. "
+            "Default: value of MW2SLOB_AUTHKEY environment variable"
+        ),
+    )
+
+    parser_worker.add_argument(
+        "-w",
+        "--workdir",
+        type=str,
+        default=".",
+        help=("Directory for temporary files. " "Default: %(default)s"),
+    )
+
+    parser_worker.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of conversion processes. Default: number of CPUs",
+    )
+
+    parser_worker.add_argument(
+        "--dump-dir",
+        type=str,
+        help=(
+            "Directory with dump files on this machine. "
+            "Default: same paths as on coordinator"
+        ),
+    )
+
+    parser_worker.set_defaults(func=cli_worker)
+
     parser_scrape = subparsers.add_parser(
-        "scrape", parents=[base_parser], help="Convert from mwscrape CouchDB"
+        "scrape",
+        parents=[base_parser, dry_run_parser],
+        help="Convert from mwscrape CouchDB",
     )
 
     parser_scrape.add_argument(
@@ -0,0 +1,134 @@
+import random
+import statistics
+import time
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Sequence
+from typing import Tuple
+
+import slob
+
+from . import sizereport
+
+# compressions slob files can be created with, see --compression
+CODECS = ("lzma2", "zlib")
+
+# minimum bin sizes to try, kilobytes
+BIN_SIZES = (32, 64, 128, 256, 384, 512, 1024, 2048)
+
+
+class Setting(NamedTuple):
+    codec: str
+    bin_size: int
+    bins: int
+    html_size: int
+    compressed_size: int
+    # total time to compress all bins, seconds
+    compress_seconds: float
+    # time to get one random article (decompress its bin and slice
+    # it out), seconds, one value per lookup
+    lookup_seconds: List[float]
+
+    def ratio(self) -> float:
+        return self.compressed_size / self.html_size if self.html_size else 0.0
+
+
+def measure(
+    items: Sequence[bytes],
+    codec: str,
+    bin_size: int,
+    lookups: Sequence[int],
+) -> Setting:
+    """
+    Compress items in bins with codec, then look up items at given
+    indexes, each from scratch, as reader opening random article does
+    (nothing is cached between lookups).
+    """
+    compression = slob.COMPRESSIONS[codec]
+    compressed = []
+    # bin of each item and item's offset and size in it
+    locations = []
+    t0 = time.perf_counter()
+    for bin_number, current_bin in enumerate(sizereport.make_bins(items, bin_size)):
+        offset = 0
+        for item in current_bin:
+            locations.append((bin_number, offset, len(item)))
+            offset += len(item)
+        compressed.append(compression.compress(b"".join(current_bin)))
+    compress_seconds = time.perf_counter() - t0
+    lookup_seconds = []
+    for i in lookups:
+        bin_number, offset, size = locations[i]
+        t0 = time.perf_counter()
+        content = compression.decompress(compressed[bin_number])
+        content[offset : offset + size]
+        lookup_seconds.append(time.perf_counter() - t0)
+    return Setting(
+        codec,
+        bin_size,
+        len(compressed),
+        sum(len(item) for item in items),
+        sum(len(data) for data in compressed),
+        compress_seconds,
+        lookup_seconds,
+    )
+
+
+def compression_report(
+    items: Iterable[bytes],
+    codecs: Iterable[str] = CODECS,
+    bin_sizes: Iterable[int] = BIN_SIZES,
+    lookups: int = 200,
+    seed=None,
+) -> List[Setting]:
+    """
+    Measure each combination of codec and bin size (in kilobytes) on
+    converted articles. Same random articles are looked up with every
+    setting.
+    """
+    items = list(items)
+    if not items:
+        return []
+    rng = random.Random(seed)
+    indexes = [rng.randrange(len(items)) for _ in range(lookups)]
+    return [
+        measure(items, codec, bin_size * 1024, indexes)
+        for codec in codecs
+        for bin_size in bin_sizes
+    ]
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """
+    >>> percentile([4, 1, 3, 2], 0.5), percentile([4, 1, 3, 2], 0.95)
+    (3, 4)
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def print_report(report: List[Setting], current: Tuple[str, int]):
+    """
+    Print measurements, marking current setting (codec and bin size in
+    kilobytes) with *.
+    """
+    if not report:
+        print("No articles")
+        return
+    print(f"{report[0].html_size} bytes of HTML")
+    print(
+        f"  {'codec':6} {'bin KB':>7} {'bins':>6} {'size':>12} {'ratio':>7} "
+        f"{'compress s':>10} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}"
+    )
+    for setting in report:
+        mark = "*" if (setting.codec, setting.bin_size // 1024) == current else " "
+        latency = setting.lookup_seconds or [0.0]
+        print(
+            f"{mark} {setting.codec:6} {setting.bin_size // 1024:>7} "
+            f"{setting.bins:>6} {setting.compressed_size:>12} "
+            f"{setting.ratio():>7.1%} {setting.compress_seconds:>10.2f} "
+            f"{statistics.mean(latency) * 1000:>8.2f} "
+            f"{percentile(latency, 0.5) * 1000:>8.2f} "
+            f"{percentile(latency, 0.95) * 1000:>8.2f}"
+        )
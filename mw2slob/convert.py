@@ -1,12 +1,20 @@
 import collections
+import contextlib
 import functools
 import json
 import logging
 import math
 import re
+import signal
+import threading
+import time
+import traceback
 import typing
+from typing import Callable
+from typing import Dict
 from typing import Iterable
 from typing import Mapping
+from typing import Optional
 from urllib.parse import quote
 from urllib.parse import unquote
 from urllib.parse import urlparse
@@ -15,13 +23,45 @@ from urllib.parse import urlunparse
 import cssutils
 import lxml.html
 import lxml.html.clean
-from lxml.cssselect import CSSSelector
+from lxml.cssselect import CSSSelector as LxmlCSSSelector
 from lxml.html import builder as E
 from lxml.html.soupparser import fromstring
 
 EM = E.ElementMaker()
 
-CSSSelector = functools.partial(CSSSelector, translator="html")
+
+class CSSSelector:
+    """
+    CSS selector (HTML translator) compiled separately in each thread
+    that uses it. lxml locks compiled XPath while evaluating it, so one
+    shared instance would let only one thread at a time match it.
+
+    >>> selector = CSSSelector("p.x")
+    >>> [e.text for e in selector(lxml.html.fromstring("<p class=x>a</p>"))]
+    ['a']
+    >>> selector.css
+    'p.x'
+    """
+
+    def __init__(self, css: str):
+        self.css = css
+        self.local = threading.local()
+
+    def __call__(self, element):
+        try:
+            compiled = self.local.compiled
+        except AttributeError:
+            compiled = self.local.compiled = LxmlCSSSelector(
+                self.css, translator="html"
+            )
+        return compiled(element)
+
+    def __reduce__(self):
+        return CSSSelector, (self.css,)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.css!r})"
+
 
 log = logging.getLogger(__name__)
 
@@ -41,7 +81,11 @@ ConvertParams = collections.namedtuple(
         "encoding",
         "remove_embedded_bg",
         "ensure_ext_image_urls",
+        "minify",
+        # where article was read from, such as dump file and line
+        "source",
     ],
+    defaults=(False, None),
 )
 
 NEWLINE_RE = re.compile(r"[\n]{2,}")
@@ -68,9 +112,7 @@ SEL_MATH = CSSSelector(
 SEL_HREF = CSSSelector("[href]")
 SEL_SRC = CSSSelector("[src]")
 SEL_ELEMENT_STYLE = CSSSelector("[style]")
-SEL_GEO_NONDEFAULT = CSSSelector(".geo-nondefault")
-SEL_GEO_MICROFORMAT = CSSSelector(".geo")
-SEL_GEO_GEO_DMS = CSSSelector(".geo-geo-dms")
+SEL_GEO = CSSSelector(".geo-nondefault, .geo, .geo-geo-dms")
 
 # Enterprise HTML dump
 SEL_ONLINE_LINK = CSSSelector('link[rel="dc:isVersionOf"]')
@@ -87,6 +129,7 @@ SEL_A_AUTONUMBER = CSSSelector("a.autonumber")
 SEL_LINKS_ELEMENTS = CSSSelector("link")
 SEL_A_MAP = CSSSelector("a.mw-kartographer-map")
 
+SEL_TOC = CSSSelector("#toc")
 SEL_H2 = CSSSelector("h2")
 SEL_H3 = CSSSelector("h3")
 
@@ -205,6 +248,166 @@ def fix_thumb_width(path):
     return path[:start] + str(new_width) + path[end:]
 
 
+URL_CACHE_SIZE = 1 << 16
+
+
+class UrlRewriter:
+    """
+    Converts link and image URLs in articles. Interwiki URL templates
+    are parsed once, and conversion results are cached, so rewriter
+    should be created once for given site settings and reused for all
+    articles - see :func:`url_rewriter`.
+
+    >>> x_url = UrlRewriter(articlepath="./", server="http://en.wikipedia.org")
+    >>> x_url("./ABC_D#xyz"), x_url("./ABC_D#xyz", title="ABC D")
+    ('ABC%20D#xyz', '#xyz')
+    >>> x_url.srcset("//example.com/a.png 2x, ./b.png 15w")
+    'http://example.com/a.png 2x, b.png 15w'
+    """
+
+    def __init__(
+        self,
+        server=None,
+        articlepath="/wiki/",
+        site_articlepath=None,
+        namespaces=None,
+        interwiki=None,
+        ensure_ext_image_urls=False,
+        cache_size=URL_CACHE_SIZE,
+    ):
+        self.server = server
+        self.articlepath = articlepath
+        self.site_articlepath = (
+            articlepath if site_articlepath is None else site_articlepath
+        )
+        self.namespaces = {} if namespaces is None else namespaces
+        self.interwiki = {} if interwiki is None else interwiki
+        self.interwiki_templates = {}
+        self.ensure_ext_image_urls = ensure_ext_image_urls
+        self.convert = functools.lru_cache(maxsize=cache_size)(self.convert_uncached)
+
+    def interwiki_template(self, prefix):
+        template = self.interwiki_templates.get(prefix)
+        if template is None:
+            template = urlparse(self.interwiki[prefix])
+            if not template.scheme:
+                template = template._replace(scheme="http")
+            self.interwiki_templates[prefix] = template
+        return template
+
+    def mk_ext_url(self, url):
+        return mk_ext_url(self.server, self.articlepath, self.site_articlepath, url)
+
+    def convert_uncached(self, url):
+        """
+        Return converted URL, and, if URL has a fragment, URL's path and
+        URL converted for when the path is that of the article URL is in.
+        """
+        parsed = urlparse(url)
+
+        if parsed.netloc:
+            if not parsed.scheme:
+                parsed = parsed._replace(scheme="http")
+            if parsed.netloc.endswith("upload.wikimedia.org"):
+                parsed = parsed._replace(path=fix_thumb_width(parsed.path))
+            return urlunparse(parsed), None, None
+
+        path = parsed.path
+
+        if self.ensure_ext_image_urls and is_image(path):
+            return self.mk_ext_url(url), None, None
+
+        if parsed.query:
+            path += "?" + parsed.query
+
+        articlepath = self.articlepath
+        if path.startswith(articlepath):
+            path = path[len(articlepath) :]
+            if ":" in path:
+                prefix, _ = path.split(":", 1)
+                prefix = unquote(prefix)
+                if prefix in self.namespaces and self.server:
+                    # Replace links to non-article namespaces
+                    # like Categories or  Appendix with external links
+                    return self.mk_ext_url(url), None, None
+        else:
+            prefix = parsed.scheme
+            if prefix and prefix in self.interwiki:
+                template = self.interwiki_template(prefix)
+                return (
+                    urlunparse(
+                        template._replace(
+                            path=template.path.replace("$1", path),
+                            fragment=parsed.fragment,
+                        )
+                    ),
+                    None,
+                    None,
+                )
+
+        converted = urlunparse(
+            parsed._replace(
+                path=path.replace("/", "%2F").replace(":", "%3A").replace("_", "%20")
+            )
+        )
+        if parsed.fragment:
+            # it's a footnote, get rid of article's own path -
+            # works in a browser but confuses aard2-android
+            return converted, path, urlunparse(parsed._replace(path=""))
+        return converted, None, None
+
+    def __call__(self, url, title=None):
+        converted, path, converted_in_article = self.convert(url)
+        if title and path is not None and title.replace(" ", "_") == path:
+            return converted_in_article
+        return converted
+
+    def srcset(self, value):
+        parts = value.split(", ")
+        converted = []
+        for part in parts:
+            subparts = part.strip().split(" ", 1)
+            subparts[0] = self(subparts[0])
+            converted.append(" ".join(subparts))
+        return ", ".join(converted)
+
+
+_URL_REWRITERS = {}
+
+
+def url_rewriter(
+    server, articlepath, site_articlepath, namespaces, interwiki, ensure_ext_image_urls
+) -> UrlRewriter:
+    """
+    Return rewriter for these settings, reusing previously created one
+    if possible.
+    """
+    # namespaces and interwiki are the same mappings for all articles
+    # converted in a process, rewriter keeps references to them so
+    # their ids can't be reused while it's cached
+    key = (
+        server,
+        articlepath,
+        site_articlepath,
+        id(namespaces),
+        id(interwiki),
+        ensure_ext_image_urls,
+    )
+    rewriter = _URL_REWRITERS.get(key)
+    if rewriter is None:
+        if len(_URL_REWRITERS) > 16:
+            _URL_REWRITERS.clear()
+        rewriter = _URL_REWRITERS[key] = UrlRewriter(
+            server=server,
+            articlepath=articlepath,
+            site_articlepath=site_articlepath,
+            namespaces=namespaces,
+            interwiki=interwiki,
+            ensure_ext_image_urls=ensure_ext_image_urls,
+        )
+    return rewriter
+
+
 def convert_url(
     url,
     server=None,
@@ -254,59 +457,16 @@ def convert_url(
     '#xyz'
 
     """
-    if site_articlepath is None:
-        site_articlepath = articlepath
-    if namespaces is None:
-        namespaces = {}
-    if interwiki is None:
-        interwiki = {}
-    parsed = urlparse(url)._asdict()
-
-    if parsed["netloc"]:
-        if not parsed["scheme"]:
-            parsed["scheme"] = "http"
-        if parsed["netloc"].endswith("upload.wikimedia.org"):
-            parsed["path"] = fix_thumb_width(parsed["path"])
-        return urlunparse(tuple(parsed.values()))
-
-    path = parsed["path"]
-
-    if ensure_ext_image_urls and is_image(path):
-        return mk_ext_url(server, articlepath, site_articlepath, url)
-
-    if parsed["query"]:
-        path += "?" + parsed["query"]
-
-    if path.startswith(articlepath):
-        path = path[len(articlepath) :]
-        if ":" in path:
-            prefix, _ = path.split(":", 1)
-            prefix = unquote(prefix)
-            if prefix in namespaces and server:
-                # Replace links to non-article namespaces
-                # like Categories or  Appendix with external links
-                return mk_ext_url(server, articlepath, site_articlepath, url)
-    else:
-        prefix = parsed["scheme"]
-        if prefix and prefix in interwiki:
-            url_template = interwiki[prefix]
-            parsed_interwiki = urlparse(url_template)._asdict()
-            parsed_interwiki["path"] = parsed_interwiki["path"].replace("$1", path)
-            parsed_interwiki["fragment"] = parsed["fragment"]
-            if not parsed_interwiki["scheme"]:
-                parsed_interwiki["scheme"] = "http"
-            return urlunparse(tuple(parsed_interwiki.values()))
-
-    if title and parsed["fragment"] and title.replace(" ", "_") == path:
-        # it's a footnote, get rid of article's own path -
-        # works in a browser but confuses aard2-android
-        parsed["path"] = ""
-    else:
-        parsed["path"] = (
-            path.replace("/", "%2F").replace(":", "%3A").replace("_", "%20")
-        )
-
-    return urlunparse(tuple(parsed.values()))
+    rewriter = UrlRewriter(
+        server=server,
+        articlepath=articlepath,
+        site_articlepath=site_articlepath,
+        namespaces=namespaces,
+        interwiki=interwiki,
+        ensure_ext_image_urls=ensure_ext_image_urls,
+        cache_size=0,
+    )
+    return rewriter(url, title=title)
 
 
 def convert_srcset(value, **kwargs):
@@ -326,13 +486,7 @@ def convert_srcset(value, **kwargs):
     >>> convert_srcset("https://maps.wikimedia.org/img/osm-intl,12,a,a,270x200@2x.png?lang=en&amp;domain=simple.wikipedia.org&amp;title=Rebeuvelier&amp;groups=_69ef66da20df012d8c85e16fa2be4e060917327c")
     'https://maps.wikimedia.org/img/osm-intl,12,a,a,270x200@2x.png?lang=en&amp;domain=simple.wikipedia.org&amp;title=Rebeuvelier&amp;groups=_69ef66da20df012d8c85e16fa2be4e060917327c'
     """
-    parts = value.split(", ")
-    converted = []
-    for part in parts:
-        subparts = part.strip().split(" ", 1)
-        subparts[0] = convert_url(subparts[0], **kwargs)
-        converted.append(" ".join(subparts))
-    return ", ".join(converted)
+    return UrlRewriter(cache_size=0, **kwargs).srcset(value)
 
 
 def mkgeolink(latitude, longitude):
@@ -342,36 +496,90 @@ def mkgeolink(latitude, longitude):
     )
 
 
-def convert_geo_microformat(doc, selector=SEL_GEO_NONDEFAULT, drop_parent_tree=True):
-    for geo_nondefault in selector(doc):
-        geo_items = geo_nondefault.cssselect(".geo")
-        for geo in geo_items:
-            coords = geo.text
-            if coords and ";" in coords:
-                latitude, longitude = coords.split(";", 1)
-                a = mkgeolink(latitude, longitude)
-                geo_nondefault.getparent().addnext(a)
-        if drop_parent_tree:
-            geo_nondefault.drop_tree()
-        else:
-            for geo_dec in geo_nondefault.cssselect(".geo-dec"):
-                geo_dec.drop_tree()
+def is_attached(element, root):
+    while element is not None:
+        if element is root:
+            return True
+        element = element.getparent()
+    return False
 
 
-def convert_geo_microformat2(doc):
-    for geo in SEL_GEO_MICROFORMAT(doc):
-        latitude = geo.cssselect(".latitude")
-        longitude = geo.cssselect(".longitude")
-        if latitude and longitude:
-            latitude = latitude[0].text
-            longitude = longitude[0].text
+def geo_elements(doc):
+    """
+    Elements with geo microformat classes found in one pass over the
+    document, grouped by class.
+
+    >>> doc = lxml.html.fromstring(
+    ...     '<div><p class="geo-geo-dms"><span class="geo">1;2</span></p>'
+    ...     '<p><span class="geo-nondefault geo">3;4</span></p></div>')
+    >>> [[e.get("class") for e in items] for items in geo_elements(doc)]
+    [['geo-nondefault geo'], ['geo', 'geo-nondefault geo'], ['geo-geo-dms']]
+    """
+    nondefault, geo, geo_dms = [], [], []
+    for element in SEL_GEO(doc):
+        classes = element.get("class").split()
+        if "geo-nondefault" in classes:
+            nondefault.append(element)
+        if "geo" in classes:
+            geo.append(element)
+        if "geo-geo-dms" in classes:
+            geo_dms.append(element)
+    return nondefault, geo, geo_dms
+
+
+def add_geo_links(container):
+    for geo in container.find_class("geo"):
+        coords = geo.text
+        if coords and ";" in coords:
+            latitude, longitude = coords.split(";", 1)
             a = mkgeolink(latitude, longitude)
+            container.getparent().addnext(a)
+
+
+def convert_geo_nondefault(doc, items):
+    for geo_nondefault in items:
+        if not is_attached(geo_nondefault, doc):
+            continue
+        add_geo_links(geo_nondefault)
+        geo_nondefault.drop_tree()
+
+
+def convert_geo_latlon(doc, items):
+    for geo in items:
+        if not is_attached(geo, doc):
+            continue
+        latitude = geo.find_class("latitude")
+        longitude = geo.find_class("longitude")
+        if latitude and longitude:
+            a = mkgeolink(latitude[0].text, longitude[0].text)
             geo.addnext(a)
             geo.drop_tree()
 
 
-def convert_geo_microformat3(doc):
-    convert_geo_microformat(doc, selector=SEL_GEO_GEO_DMS, drop_parent_tree=False)
+def convert_geo_dms(doc, items):
+    for geo_geo_dms in items:
+        if not is_attached(geo_geo_dms, doc):
+            continue
+        add_geo_links(geo_geo_dms)
+        for geo_dec in geo_geo_dms.find_class("geo-dec"):
+            geo_dec.drop_tree()
+
+
+def convert_geo(doc):
+    nondefault, geo, geo_dms = geo_elements(doc)
+    # same order as separate passes over the document would go,
+    # elements dropped by earlier stage are skipped
+    for convert_stage, items in (
+        (convert_geo_nondefault, nondefault),
+        (convert_geo_latlon, geo),
+        (convert_geo_dms, geo_dms),
+    ):
+        if not items:
+            continue
+        try:
+            convert_stage(doc, items)
+        except Exception:
+            log.exception("Failed to convert geo")
 
 
 def convert_map(doc, selector=SEL_A_MAP):
@@ -389,7 +597,7 @@ def convert_map(doc, selector=SEL_A_MAP):
             item.attrib.pop("data-style")
             item.attrib.pop("data-height")
             item.attrib.pop("data-width")
-            for img in item.cssselect("img"):
+            for img in item.iter("img"):
                 img.attrib.pop("srcset", None)
                 img.attrib["src"] = tile_url
         except Exception:
@@ -402,26 +610,76 @@ def convert_map(doc, selector=SEL_A_MAP):
             item.drop_tree()
 
 
-def mktoc_level(container, level) -> typing.List:
-    toc_elements = []
-    if level > 4:
-        return toc_elements
-    selectH = CSSSelector(f"h{level}")
-    for h in selectH(container):
-        h_id = h.attrib.get("id")
-        for empty_span in h.cssselect("span:empty"):
-            empty_span.drop_tree()
-        if h_id:
-            parent = h.getparent()
-            sub_items = mktoc_level(parent, level + 1)
-            sub_items_list = (E.OL(*sub_items),) if sub_items else ()
-            toc_item = E.LI(E.A(h.text_content(), href=f"#{h_id}"), *sub_items_list)
-            toc_elements.append(toc_item)
-    return toc_elements
+TOC_HEADINGS = ("h2", "h3", "h4")
+
+
+def drop_empty_spans(element):
+    for span in [
+        span for span in element.iter("span") if len(span) == 0 and not span.text
+    ]:
+        span.drop_tree()
+
+
+def mk_toc_items(items) -> typing.List:
+    return [
+        E.LI(
+            E.A(text, href=f"#{h_id}"),
+            *((E.OL(*mk_toc_items(sub_items)),) if sub_items else ()),
+        )
+        for text, h_id, sub_items in items
+    ]
 
 
 def mktoc_elements(doc):
-    toc_elements = mktoc_level(doc, 2)
+    """
+    Table of contents items for h2-h4 headings with ids, nested according
+    to sections they are in: lower level heading goes under preceding
+    higher level heading if it is within that heading's parent element.
+
+    >>> doc = lxml.html.fromstring(
+    ...     '<div><h3 id="x">X</h3>'
+    ...     '<section><h2 id="a">A<span></span></h2>'
+    ...     '<section><h3 id="b">B</h3><section><h4 id="c">C</h4></section></section>'
+    ...     '<section><h3>D</h3><section><h4 id="e">E</h4></section></section>'
+    ...     '</section><section><h2 id="f">F</h2><section><h4 id="g">G</h4></section></section>'
+    ...     '</div>'
+    ... )
+    >>> print(lxml.html.tostring(E.OL(*mktoc_elements(doc))).decode())
+    <ol class="toc"><li><a href="#a">A</a><ol><li><a href="#b">B</a><ol><li><a href="#c">C</a></li></ol></li></ol></li><li><a href="#f">F</a></li></ol>
+    >>> print(lxml.html.tostring(doc.find(".//h2")).decode())
+    <h2 id="a">A</h2>
+    """
+    toc_items = []
+    # (level, heading's parent, sub items or None if heading isn't
+    # in table of contents)
+    stack: typing.List[typing.Tuple[int, typing.Any, typing.Optional[list]]] = []
+    for h in doc.iter(*TOC_HEADINGS):
+        level = int(h.tag[1])
+        parent = h.getparent()
+        ancestors = None
+        while stack:
+            stack_level, stack_parent, _ = stack[-1]
+            if stack_level < level:
+                if ancestors is None:
+                    ancestors = set(h.iterancestors())
+                if stack_parent in ancestors:
+                    break
+            stack.pop()
+        if level == 2:
+            items = toc_items
+        elif stack and stack[-1][0] == level - 1:
+            items = stack[-1][2]
+        else:
+            items = None
+        sub_items = None
+        if items is not None:
+            drop_empty_spans(h)
+            h_id = h.attrib.get("id")
+            if h_id:
+                sub_items = []
+                items.append((h.text_content(), h_id, sub_items))
+        stack.append((level, parent, sub_items))
+    toc_elements = mk_toc_items(toc_items)
     if len(toc_elements) > 0:
         toc_elements.append(E.CLASS("toc"))
     return toc_elements
@@ -449,8 +707,268 @@ CSS_LINKS = (
 )
 
 
+# Same as CSS_LINKS, without attributes that are default anyway
+CSS_LINKS_MIN = (
+    '<link rel="stylesheet" href="~/css/shared.css">'
+    '<link rel="stylesheet" href="~/css/mediawiki_shared.css">'
+    '<link rel="stylesheet" href="~/css/mediawiki_monobook.css">'
+    '<link rel="alternate stylesheet" href="~/css/night.css" title="Night">'
+)
+
+# ASCII whitespace only, non-breaking spaces must stay as they are
+WHITESPACE_RE = re.compile(r"[ \t\n\r\f]+")
+
+# whitespace is significant in text of these elements
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+
+EMPTY_WRAPPER_TAGS = ("span", "div")
+
+# RDFa and data attributes left by Parsoid that nothing in article
+# reader uses - data-tex is what MathJax renders math from
+PRUNED_ATTRS = {"about", "property", "resource", "typeof", "prefix", "vocab"}
+KEPT_DATA_ATTRS = {"data-tex"}
+
+
+def minify_whitespace(doc):
+    """
+    >>> doc = lxml.html.fromstring("<div>\\n  <p>a\\n  b&#160; c</p>  <pre> x\\n  y </pre>\\n\\n</div>")
+    >>> minify_whitespace(doc)
+    >>> lxml.html.tostring(doc)
+    b'<div> <p>a b&#160; c</p> <pre> x\\n  y </pre> </div>'
+    """
+    preserved = set()
+    for item in doc.iter(*PRESERVE_WHITESPACE_TAGS):
+        preserved.update(item.iterdescendants())
+        preserved.add(item)
+    for item in doc.iter():
+        if item not in preserved and item.text:
+            item.text = WHITESPACE_RE.sub(" ", item.text)
+        if item.tail and item.getparent() not in preserved:
+            item.tail = WHITESPACE_RE.sub(" ", item.tail)
+
+
+def minify_wrappers(doc):
+    """
+    >>> doc = lxml.html.fromstring('<div><span>a</span><div><span></span></div><div class="x"></div>b</div>')
+    >>> minify_wrappers(doc)
+    >>> lxml.html.tostring(doc)
+    b'<div>a<div class="x"></div>b</div>'
+    """
+    # reversed document order so that wrappers left empty
+    # after their children are removed are removed too
+    for item in reversed(list(doc.iter(*EMPTY_WRAPPER_TAGS))):
+        if item.attrib or item is doc:
+            continue
+        if len(item) == 0 and not item.text:
+            item.drop_tree()
+        elif item.tag == "span":
+            item.drop_tag()
+
+
+def minify_attrs(doc):
+    """
+    >>> doc = lxml.html.fromstring('<p class="a  b a" data-x="1" data-tex="x" resource="./y"><b class=" ">b</b></p>')
+    >>> minify_attrs(doc)
+    >>> lxml.html.tostring(doc)
+    b'<p class="a b" data-tex="x"><b>b</b></p>'
+    """
+    for item in doc.iter():
+        attrib = item.attrib
+        if not attrib:
+            continue
+        for name in list(attrib):
+            if name in PRUNED_ATTRS or (
+                name.startswith("data-") and name not in KEPT_DATA_ATTRS
+            ):
+                del attrib[name]
+        class_attr = attrib.get("class")
+        if class_attr is not None:
+            classes = " ".join(dict.fromkeys(class_attr.split()))
+            if classes:
+                if classes != class_attr:
+                    attrib["class"] = classes
+            else:
+                del attrib["class"]
+
+
+def minify(doc):
+    minify_attrs(doc)
+    minify_wrappers(doc)
+    minify_whitespace(doc)
+
+
+BACKGROUND_PROPERTIES = {"background", "background-color"}
+
+# quoted strings and parenthesized values (such as url(...)) may contain ";"
+STYLE_TOKEN_RE = re.compile(
+    r"""[^;"'()]+|"[^"]*"|'[^']*'|\((?:[^"'()]|"[^"]*"|'[^']*')*\)|;|."""
+)
+
+
+def remove_background(style):
+    """
+    Remove background and background-color declarations from style
+    attribute value. Returns None if style can't be tokenized, such as
+    when it has unbalanced quotes or parentheses.
+
+    >>> remove_background("color: red; background: blue")
+    'color: red'
+    >>> remove_background("BACKGROUND-COLOR:#fff;border:1px solid;")
+    'border: 1px solid'
+    >>> remove_background("background-image: url('a;b.png'); background:red")
+    "background-image: url('a;b.png')"
+    >>> remove_background("color: red")
+    'color: red'
+    >>> remove_background("background: url(a.png")
+    >>> remove_background("background: red; color")
+    """
+    if "background" not in style.lower():
+        return style
+    declarations = []
+    declaration = []
+    for token in STYLE_TOKEN_RE.findall(style):
+        if token == ";":
+            declarations.append("".join(declaration))
+            declaration.clear()
+        elif token in "\"'()":
+            return None
+        else:
+            declaration.append(token)
+    declarations.append("".join(declaration))
+    kept = []
+    for declaration in declarations:
+        name, sep, value = declaration.partition(":")
+        name = name.strip()
+        if not sep:
+            if name:
+                return None
+            continue
+        if name.lower() not in BACKGROUND_PROPERTIES:
+            kept.append(f"{name}: {value.strip()}")
+    return "; ".join(kept)
+
+
+def remove_background_cssutils(style):
+    try:
+        ss = cssutils.parseStyle(style)
+    except Exception:
+        log.exception("Failed to parse style attr with value %r", style)
+        return None
+    ss.backgroundColor = None
+    ss.background = None
+    return ss.cssText
+
+
+RTL_START = '<div dir="rtl" class="rtl">'
+RTL_END = "</div>"
+
+
 def wrap_rtl(text):
-    return f'<div dir="rtl" class="rtl">{text}</div>'
+    return f"{RTL_START}{text}{RTL_END}"
+
+
+def wrapper_text(
+    minify_html: bool, has_math: bool, rtl: bool
+) -> typing.Tuple[str, str]:
+    css_links = CSS_LINKS_MIN if minify_html else CSS_LINKS
+    math_jax = MATH_JAX_SCRIPTS if has_math else ""
+    start = "".join((css_links, math_jax, RTL_START if rtl else ""))
+    end = RTL_END if rtl else ""
+    return start, end
+
+
+@functools.lru_cache(maxsize=None)
+def encoded_wrapper(
+    encoding: str, minify_html: bool, has_math: bool, rtl: bool
+) -> typing.Optional[typing.Tuple[bytes, bytes]]:
+    """
+    Encoded text that goes before and after serialized article, None
+    for encodings with byte order mark, which can't be encoded
+    piecewise.
+
+    >>> encoded_wrapper("utf-8", True, False, True)[1]
+    b'</div>'
+    >>> encoded_wrapper("utf-16", True, False, True)
+    """
+    if "".encode(encoding):
+        return None
+    start, end = wrapper_text(minify_html, has_math, rtl)
+    return start.encode(encoding), end.encode(encoding)
+
+
+def serialize(
+    doc, encoding: str, minify_html: bool, has_math: bool, rtl: bool
+) -> bytes:
+    """
+    Serialize article document with style and script links, encoded.
+    Document is serialized to encoded bytes directly when libxml2
+    supports the encoding, characters the encoding can't represent
+    become character references.
+
+    >>> doc = lxml.html.fromstring("<p>ä €</p>")
+    >>> serialize(doc, "utf-8", True, False, True)[-31:].decode()
+    'class="rtl"><p>ä €</p></div>'
+    >>> serialize(doc, "iso-8859-1", True, False, False)[-16:]
+    b'<p>\\xe4 &#8364;</p>'
+    """
+    wrapper = encoded_wrapper(encoding, minify_html, has_math, rtl)
+    if wrapper is None:
+        start, end = wrapper_text(minify_html, has_math, rtl)
+        text = lxml.html.tostring(doc, encoding="unicode")
+        return "".join((start, text, end)).encode(encoding)
+    start, end = wrapper
+    try:
+        body = lxml.html.tostring(doc, encoding=encoding)
+    except LookupError:
+        # encoding name libxml2 doesn't know
+        body = lxml.html.tostring(doc, encoding="unicode").encode(encoding)
+    return b"".join((start, body, end))
+
+
+# conversion stages timed with convert(..., timings=)
+STAGES = (
+    "parse",
+    "clean",
+    "geo",
+    "filters",
+    "cleanup",
+    "links",
+    "math",
+    "attrs",
+    "header",
+    "minify",
+    "serialize",
+)
+
+
+def no_lap(stage: str):
+    pass
+
+
+def stage_timer(timings: Optional[Dict[str, float]]) -> Callable[[str], None]:
+    """
+    Function that adds time since it was last called (or since
+    timer was created) to given stage's time.
+
+    >>> timings = {}
+    >>> lap = stage_timer(timings)
+    >>> lap("a"); lap("b"); lap("a")
+    >>> sorted(timings), all(t >= 0 for t in timings.values())
+    (['a', 'b'], True)
+    >>> stage_timer(None) is no_lap
+    True
+    """
+    if timings is None:
+        return no_lap
+    last = time.perf_counter()
+
+    def lap(stage: str):
+        nonlocal last
+        now = time.perf_counter()
+        timings[stage] = timings.get(stage, 0.0) + now - last
+        last = now
+
+    return lap
 
 
 def convert(
@@ -458,7 +976,17 @@ def convert(
     filters: Iterable,
     namespaces: Mapping[str, str],
     interwiki: Mapping[str, str],
+    fast: bool = False,
+    timings: Optional[Dict[str, float]] = None,
 ):
+    """
+    Convert article HTML. Fast conversion, meant for articles that take
+    too long to convert normally, parses with libxml2 instead of
+    BeautifulSoup and skips geo, map and background conversion, TOC
+    and srcset rewriting. If timings is given, seconds spent in each
+    conversion stage (see STAGES) are added to it.
+    """
+    lap = stage_timer(timings)
     (
         title,
         _,
@@ -470,48 +998,35 @@ def convert(
         encoding,
         remove_embedded_bg,
         ensure_ext_image_urls,
+        minify_html,
+        _,
     ) = params
     text = NEWLINE_RE.sub("\n", text)
-    doc = fromstring(text)
-
-    x_url = functools.partial(
-        convert_url,
-        server=server,
-        articlepath=articlepath,
-        site_articlepath=site_articlepath,
-        ensure_ext_image_urls=ensure_ext_image_urls,
-        namespaces=namespaces,
-        interwiki=interwiki,
-        title=title,
-    )
+    doc = lxml.html.document_fromstring(text) if fast else fromstring(text)
+    lap("parse")
 
-    x_srcset = functools.partial(
-        convert_srcset,
-        server=server,
-        articlepath=articlepath,
-        site_articlepath=site_articlepath,
-        ensure_ext_image_urls=ensure_ext_image_urls,
-        namespaces=namespaces,
-        interwiki=interwiki,
+    x_url = url_rewriter(
+        server,
+        articlepath,
+        site_articlepath,
+        namespaces,
+        interwiki,
+        ensure_ext_image_urls,
     )
 
     CLEANER(doc)
+    lap("clean")
 
-    for convert_geo in (
-        convert_geo_microformat,
-        convert_geo_microformat2,
-        convert_geo_microformat3,
-    ):
-        try:
-            convert_geo(doc)
-        except Exception:
-            log.exception("Failed to convert geo")
+    if not fast:
+        convert_geo(doc)
+    lap("geo")
 
     for selector in filters:
         if isinstance(selector, str):
             selector = CSSSelector(selector)
         for item in selector(doc):
             item.drop_tree()
+    lap("filters")
 
     for item in SEL_HEAD(doc):
         item.drop_tree()
@@ -525,22 +1040,21 @@ def convert(
     for item in SEL_A_NEW(doc):
         item.drop_tag()
 
-    for sel_element_with_style in selector_list(remove_embedded_bg):
+    for sel_element_with_style in () if fast else selector_list(remove_embedded_bg):
         for item in sel_element_with_style(doc):
             style = item.attrib["style"]
-            try:
-                ss = cssutils.parseStyle(style)
-            except Exception:
-                log.exception("Failed to parse style attr with value %r", style)
-            else:
-                ss.backgroundColor = None
-                ss.background = None
-                item.attrib["style"] = ss.cssText
+            new_style = remove_background(style)
+            if new_style is None:
+                new_style = remove_background_cssutils(style)
+            if new_style is not None:
+                item.attrib["style"] = new_style
 
-    convert_map(doc)
+    if not fast:
+        convert_map(doc)
+    lap("cleanup")
 
     for item in SEL_HREF(doc):
-        item.attrib["href"] = x_url(item.attrib["href"])
+        item.attrib["href"] = x_url(item.attrib["href"], title=title)
 
     for i, item in enumerate(SEL_A_AUTONUMBER(doc)):
         # a elements with "autonumber" class are not actually autonumbered in enterprise dumps
@@ -548,12 +1062,15 @@ def convert(
             item.text = f"[{i + 1}]"
 
     for item in SEL_SRC(doc):
-        item.attrib["src"] = x_url(item.attrib["src"])
+        item.attrib["src"] = x_url(item.attrib["src"], title=title)
 
         if "srcset" in item.attrib:
             srcset = item.attrib["srcset"]
-            if srcset:
-                item.attrib["srcset"] = x_srcset(srcset)
+            if fast:
+                del item.attrib["srcset"]
+            elif srcset:
+                item.attrib["srcset"] = x_url.srcset(srcset)
+    lap("links")
 
     for item in SEL_MW_MATH_ELEMENT(doc):
         data_mw = item.attrib.get("data-mw")
@@ -565,6 +1082,8 @@ def convert(
             if extsrc:
                 item.set("data-tex", extsrc)
 
+    lap("math")
+
     for item in SEL_WITH_DATA_MW_ATTR(doc):
         item.attrib.pop("data-mw")
     for item in SEL_WITH_DATA_MW_SECTION_ID(doc):
@@ -580,6 +1099,7 @@ def convert(
         item.attrib.pop("about")
     for item in SEL_WITH_ATTR_TITLE(doc):
         item.attrib.pop("title")
+    lap("attrs")
 
     has_math = len(SEL_MATH(doc)) > 0
 
@@ -611,6 +1131,7 @@ def convert(
         for item in SEL_IMG_TEX(doc):
             item.attrib.pop("srcset", None)
             item.attrib.pop("src", None)
+    lap("math")
 
     article_link_elements = SEL_ONLINE_LINK(doc)
     has_article_link = len(article_link_elements) > 0
@@ -625,13 +1146,18 @@ def convert(
         title_heading = E.SPAN(id="a2-title")
         title_heading.append(a)
 
-        mw_toc = doc.cssselect("#toc")
+        mw_toc = SEL_TOC(doc)
 
         def mktoc():
             toc_elements = mktoc_elements(doc)
             return E.DIV(E.OL(*toc_elements), id="a2-toc") if toc_elements else E.DIV()
 
-        toc_details = mw_toc[0] if mw_toc else mktoc()
+        if mw_toc:
+            toc_details = mw_toc[0]
+        elif fast:
+            toc_details = E.DIV()
+        else:
+            toc_details = mktoc()
         toc = mk_article_header(title_heading, toc_details)
         body = doc.find("body")
         if not body is None:
@@ -641,18 +1167,241 @@ def convert(
 
     for item in SEL_LINKS_ELEMENTS(doc):
         item.drop_tree()
+    lap("header")
 
-    math_jax = MATH_JAX_SCRIPTS if has_math else ""
-    serialized = str(lxml.html.tostring(doc, encoding="unicode"))
-    result = "".join(
-        (CSS_LINKS, math_jax, wrap_rtl(serialized) if rtl else serialized)
-    ).encode(encoding)
+    if minify_html:
+        minify(doc)
+        lap("minify")
 
+    result = serialize(doc, encoding, minify_html, has_math, rtl)
+    lap("serialize")
     return result
 
 
+def convert_stub(params: ConvertParams) -> bytes:
+    """
+    Placeholder page for article that couldn't be converted,
+    linking to online version if its URL is known.
+
+    >>> params = ConvertParams("A b", (), "", False, "https://w.org",
+    ...     "/wiki/$1", "/wiki/", "utf-8", "", False)
+    >>> print(convert_stub(params).decode())
+    <html><body><span id="a2-title"><a id="view-online-link" href="https://w.org/wiki/A%20b">A b</a></span></body></html>
+    >>> print(convert_stub(params._replace(server=None)).decode())
+    <html><body><span id="a2-title">A b</span></body></html>
+    """
+    title = params.title
+    if params.server and params.site_articlepath:
+        article_url = "".join((params.server, params.site_articlepath, quote(title)))
+        a = E.A(id="view-online-link", href=article_url)
+        a.text = title
+        title_heading = E.SPAN(a, id="a2-title")
+    else:
+        title_heading = E.SPAN(title, id="a2-title")
+    doc = E.HTML(E.BODY(title_heading))
+    serialized = lxml.html.tostring(doc, encoding="unicode")
+    return (wrap_rtl(serialized) if params.rtl else serialized).encode(params.encoding)
+
+
+def compile_filters(filters: Iterable) -> typing.List:
+    """
+    Selector instances for filters given as CSS selector strings.
+
+    >>> [type(f).__name__ for f in compile_filters(["p", "p:contains('x')"])]
+    ['CSSSelector', 'str']
+    """
+    selectors = []
+    for selector in filters:
+        if isinstance(selector, str) and ":contains(" not in selector:
+            # creating selector instances for each article
+            # appears to be expensive, create them once
+            selector = CSSSelector(selector)
+        # selectors using :contains() can't be reused,
+        # these are created for each article
+        selectors.append(selector)
+    return selectors
+
+
+class ConversionError(str):
+    """
+    Error message of failed article conversion. Also carries
+    conversion parameters (including article HTML) and traceback, so
+    that failed article can be saved to quarantine file and converted
+    again later. Article HTML is sent back from worker with error, in
+    pickled result rather than through --shared-memory buffers, which
+    is fine as long as failures are rare.
+
+    >>> import pickle
+    >>> params = ConvertParams("A", (), "<p>", *(None,) * 7)
+    >>> try:
+    ...     1 / 0
+    ... except Exception as ex:
+    ...     error = conversion_error(ex, params)
+    >>> error = pickle.loads(pickle.dumps(error))
+    >>> error, error.params.title, error.traceback.splitlines()[-1]
+    ('division by zero', 'A', 'ZeroDivisionError: division by zero')
+    """
+
+    params: Optional[ConvertParams] = None
+    traceback = ""
+
+
+def conversion_error(ex: Exception, params: ConvertParams) -> ConversionError:
+    """Error for exception being handled"""
+    error = ConversionError(str(ex))
+    error.params = params
+    error.traceback = traceback.format_exc()
+    return error
+
+
+# Not an Exception subclass so that conversion code catching
+# Exception doesn't swallow it
+class ConversionTimeout(BaseException):
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise ConversionTimeout()
+
+
+@contextlib.contextmanager
+def time_budget(seconds: Optional[float]):
+    """
+    Raise ConversionTimeout if block runs longer than given number of
+    seconds. Relies on SIGALRM, so only works in main thread on
+    platforms that have it, elsewhere block runs without limit. Time
+    spent in a single long C call (such as lxml parsing) is only
+    interrupted once that call returns.
+    """
+    if (
+        not seconds
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+    previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def safe_convert(
+    params: ConvertParams,
+    selectors: Iterable,
+    namespaces: Mapping[str, str],
+    interwiki: Mapping[str, str],
+    time_budget_seconds: Optional[float] = None,
+    stats=None,
+) -> typing.Tuple[str, Iterable, Optional[bytes], Optional[ConversionError]]:
+    """
+    Convert article, never raising: returns title, aliases, converted
+    HTML (empty if article has no text) and error, a ConversionError if
+    conversion failed. Normal conversion is followed by cheaper fast
+    conversion if normal one took longer than time budget, then stub
+    page if fast one did too. Conversion stage timings are added to
+    stats (stagetimes.StageStats) if given.
+    """
+    text = params.text
+    title = params.title
+    aliases = params.aliases
+    if text is None:
+        return title, aliases, b"", None
+    for fast in (False, True):
+        t0 = time.perf_counter()
+        timings: Optional[Dict[str, float]] = {} if stats is not None else None
+        try:
+            with time_budget(time_budget_seconds):
+                html = convert(
+                    params,
+                    selectors,
+                    namespaces,
+                    interwiki,
+                    fast=fast,
+                    timings=timings,
+                )
+        except ConversionTimeout:
+            log.warning(
+                "%s conversion of %r exceeded time budget (%.1fs)",
+                "Fast" if fast else "Normal",
+                title,
+                time.perf_counter() - t0,
+            )
+            continue
+        except KeyboardInterrupt:
+            raise
+        except Exception as ex:
+            log.exception("Failed to convert %r", title)
+            return title, aliases, None, conversion_error(ex, params)
+        if fast:
+            log.warning(
+                "Converted %r with fast conversion in %.1fs",
+                title,
+                time.perf_counter() - t0,
+            )
+        if stats is not None:
+            stats.add(title, timings)
+        return title, aliases, html, None
+    log.warning("Adding stub page for %r", title)
+    try:
+        return title, aliases, convert_stub(params), None
+    except Exception as ex:
+        log.exception("Failed to create stub page for %r", title)
+        return title, aliases, None, conversion_error(ex, params)
+
+
+def convert_batch(
+    articles: Iterable[ConvertParams],
+    filters: Iterable,
+    namespaces: Mapping[str, str],
+    interwiki: Mapping[str, str],
+    time_budget_seconds: Optional[float] = None,
+    stats=None,
+    seconds: Optional[typing.List[float]] = None,
+) -> typing.List[
+    typing.Tuple[str, Iterable, Optional[bytes], Optional[ConversionError]]
+]:
+    """
+    Convert articles, in order, compiling filters once for all of
+    them. Like safe_convert, never raises: result for article that
+    failed to convert has ConversionError instead of HTML. Seconds
+    each article took are appended to seconds list if given.
+
+    >>> params = ConvertParams("A", (), "<p>a</p><p class='x'>x</p>", False,
+    ...     "https://w.org", "/wiki/$1", "/wiki/", "utf-8", "", False, True)
+    >>> results = convert_batch([params, params._replace(text=None)],
+    ...     [".x"], {}, {})
+    >>> title, aliases, html, error = results[0]
+    >>> html[-24:], error
+    (b'</details><p>a</p></div>', None)
+    >>> results[1]
+    ('A', (), b'', None)
+    """
+    selectors = compile_filters(filters)
+    results = []
+    for params in articles:
+        t0 = time.perf_counter()
+        results.append(
+            safe_convert(
+                params,
+                selectors,
+                namespaces,
+                interwiki,
+                time_budget_seconds=time_budget_seconds,
+                stats=stats,
+            )
+        )
+        if seconds is not None:
+            seconds.append(time.perf_counter() - t0)
+    return results
+
+
+@functools.lru_cache(maxsize=None)
 def selector_list(str_value):
     if str_value:
-        return [CSSSelector(s) for s in str_value.split(",")]
+        return tuple(CSSSelector(s) for s in str_value.split(","))
     else:
-        return []
+        return ()
@@ -1,10 +1,17 @@
+import functools
+import hashlib
+import itertools
 import logging
 import multiprocessing
+import multiprocessing.pool
 import os
 import sys
+import threading
 import time
 from datetime import timedelta
+from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Mapping
 from typing import Optional
@@ -13,7 +20,15 @@ from typing import Tuple
 import slob
 
 from . import convert
+from . import cssprune
+from . import profiling
+from . import quarantine
+from . import sharedmem
 from . import siteinfo as si
+from .aliases import AliasIndex
+from .progress import Progress
+from .progress import started
+from .stagetimes import StageStats
 
 times = {}
 
@@ -62,6 +77,21 @@ class Defaults:
     observer = default_observer()
     no_math = False
     html_encoding = "utf-8"
+    dedupe_aliases = False
+    dedupe_content = False
+    prune_css = False
+    # seconds, per article conversion attempt
+    time_budget = 60.0
+    executor = "process"
+    # bytes, 0 to send articles to worker processes through pipes
+    shared_memory = 0
+    stage_times = False
+    # directory to save profiler stats to, None to not profile
+    profile_dir = None
+    # print a line for each article added
+    verbose = True
+    # file to save failed articles to, None to not save them
+    quarantine = None
 
 
 log = logging.getLogger(__name__)
@@ -69,93 +99,513 @@ log = logging.getLogger(__name__)
 HTML_CHARSET_TMPL = "text/html;charset={0}"
 
 
-SELECTORS = []
-INTERWIKI: Mapping[str, str] = {}
-NAMESPACES: Mapping[str, str] = {}
-
-
-def process_initializer(css_selectors, interwikimap, namespaces):
+# title, aliases, converted html (empty if article has no text), error
+Result = Tuple[str, Iterable[str], Optional[bytes], Optional[str]]
+
+
+# articles sent to worker process at once
+BATCH_SIZE = 100
+
+EXECUTORS = ("process", "thread")
+
+
+class ConvertState:
+    """
+    Compiled filters, interwiki map and namespaces for a conversion
+    run. Doesn't change once created, so threads can share it (filter
+    selectors compile their XPath in each thread, see
+    convert.CSSSelector).
+    """
+
+    def __init__(
+        self,
+        css_selectors: Iterable[str],
+        interwikimap: Iterable[Mapping[str, str]],
+        namespaces: Mapping[str, dict],
+        time_budget: Optional[float] = None,
+        stage_times: bool = False,
+        collect_names: bool = False,
+    ):
+        self.selectors = convert.compile_filters(css_selectors)
+        self.interwiki: Dict[str, str] = {}
+        self.namespaces: Dict[str, int] = {}
+        self.time_budget = time_budget
+        self.stage_times = stage_times
+        # collect names used in converted articles, for CSS pruning
+        self.collect_names = collect_names
+        for item in interwikimap:
+            prefix = item.get("prefix")
+            url = item.get("url")
+            if prefix and url:
+                self.interwiki[prefix] = url
+        for item in namespaces.values():
+            canonical = item.get("canonical")
+            name = item.get("*")
+            ns_id = item.get("id")
+            if ns_id:
+                if canonical:
+                    self.namespaces[canonical] = ns_id
+                    self.namespaces[canonical.lower()] = ns_id
+                if name:
+                    self.namespaces[name] = ns_id
+                    self.namespaces[name.lower()] = ns_id
+
+
+# state of worker process, set by process_initializer
+STATE: Optional[ConvertState] = None
+
+
+def process_initializer(
+    css_selectors,
+    interwikimap,
+    namespaces,
+    time_budget_seconds=None,
+    stage_times=False,
+    profile_dir=None,
+    collect_names=False,
+):
+    global STATE
     logging.basicConfig()
-    for css_selector in css_selectors:
-        if ":contains(" in css_selector:
-            # selectors using :contains() can't be reused,
-            # don't create instance here
-            SELECTORS.append(css_selector)
-        else:
-            # creating selector instances for each article
-            # appears to be expensive, create them once per process
-            SELECTORS.append(convert.CSSSelector(css_selector))
-    for item in interwikimap:
-        prefix = item.get("prefix")
-        url = item.get("url")
-        if prefix and url:
-            INTERWIKI[prefix] = url
-    for item in namespaces.values():
-        canonical = item.get("canonical")
-        name = item.get("*")
-        ns_id = item.get("id")
-        if ns_id:
-            if canonical:
-                NAMESPACES[canonical] = ns_id
-                NAMESPACES[canonical.lower()] = ns_id
-            if name:
-                NAMESPACES[name] = ns_id
-                NAMESPACES[name.lower()] = ns_id
+    profiling.init_worker(profile_dir)
+    STATE = ConvertState(
+        css_selectors,
+        interwikimap,
+        namespaces,
+        time_budget_seconds,
+        stage_times,
+        collect_names,
+    )
 
 
 def safe_convert(
     params: convert.ConvertParams,
-) -> Tuple[str, Iterable[str], Optional[bytes], Optional[str]]:
-    text = params.text
-    title = params.title
-    aliases = params.aliases
-    try:
-        if text is None:
-            return title, aliases, b"", None
-        html = convert.convert(params, SELECTORS, NAMESPACES, INTERWIKI)
-        return title, aliases, html, None
-    except KeyboardInterrupt:
-        raise
-    except Exception as ex:
-        log.exception("Failed to convert %r", title)
-        return title, aliases, None, str(ex)
+    state: Optional[ConvertState] = None,
+    stats: Optional[StageStats] = None,
+) -> Result:
+    if state is None:
+        state = STATE
+    return convert.safe_convert(
+        params,
+        state.selectors,
+        state.namespaces,
+        state.interwiki,
+        time_budget_seconds=state.time_budget,
+        stats=stats,
+    )
 
 
-def run(
-    slb: slob.Writer,
+def safe_convert_batch(
+    batch: List[convert.ConvertParams], state: Optional[ConvertState] = None
+) -> Tuple[
+    List[Result], Optional[StageStats], Optional[cssprune.UsedNames], List[float]
+]:
+    """
+    Convert batch of articles, return results, stage stats and names
+    used in converted articles (if enabled) and seconds each article
+    took to convert.
+    """
+    if state is None:
+        state = STATE
+    stats = StageStats() if state.stage_times else None
+    used_names = cssprune.UsedNames() if state.collect_names else None
+    seconds: List[float] = []
+    with profiling.profiled():
+        results = convert.convert_batch(
+            batch,
+            state.selectors,
+            state.namespaces,
+            state.interwiki,
+            time_budget_seconds=state.time_budget,
+            stats=stats,
+            seconds=seconds,
+        )
+        if used_names is not None:
+            for params, (_, _, html, error) in zip(batch, results):
+                if html and not error:
+                    used_names.update(html.decode(params.encoding, errors="replace"))
+    return results, stats, used_names, seconds
+
+
+def safe_convert_shared_batch(shared_batch: sharedmem.SharedBatch):
+    results, stats, used_names, seconds = safe_convert_batch(
+        sharedmem.read_batch(shared_batch)
+    )
+    return sharedmem.write_results(shared_batch, results), stats, used_names, seconds
+
+
+def batches(items: Iterable, size: int) -> Iterator[List]:
+    """
+    >>> list(batches(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    it = iter(items)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def convert_all(
     articles: Iterable[convert.ConvertParams],
     filters: Iterable[str],
     interwikimap: Iterable[Mapping[str, str]],
     namespaces: Mapping[str, dict],
+    processes: Optional[int] = None,
+    time_budget=Defaults.time_budget,
+    max_pending: Optional[int] = None,
+    executor=Defaults.executor,
+    shared_memory=Defaults.shared_memory,
+    stage_stats: Optional[StageStats] = None,
+    profile_dir=Defaults.profile_dir,
+    progress: Optional[Progress] = None,
+    ordered=False,
+    used_names: Optional[cssprune.UsedNames] = None,
+) -> Iterator[Result]:
+    """
+    Convert articles in worker processes, or in threads of this
+    process with "thread" executor, which avoids sending articles
+    to other processes but only runs conversions in parallel on
+    free-threaded Python. Time budget only applies in worker
+    processes.
+
+    With shared_memory buffer size (bytes) worker processes get
+    article text and return converted html through shared memory
+    instead of pipes.
+
+    If stage_stats is given, conversion stage times are measured and
+    added to it. If used_names is given, workers collect element names,
+    classes and ids of converted articles and they are added to it.
+    With profile_dir worker processes save profiler stats
+    there when they finish. progress, if given, counts batches read
+    and converted and collects conversion times.
+
+    At most max_pending batches (twice the number of workers by
+    default) are read ahead of results consumed, otherwise pool would
+    read all articles into memory while results are being added.
+
+    Results come in order batches finish converting, or in input order
+    if ordered is true, at the cost of waiting for slow batches.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * processes
+    pending = threading.BoundedSemaphore(max_pending)
+    closed = False
+    slots: Optional[sharedmem.Slots] = None
+
+    def limited(items):
+        # runs in pool's task handler thread
+        with profiling.profiled("reader"):
+            for item in items:
+                pending.acquire()
+                if closed:
+                    return
+                if progress is not None:
+                    progress.read_batch(item)
+                yield item if slots is None else slots.pack(item)
+
+    stage_times = stage_stats is not None
+    collect_names = used_names is not None
+    if executor == "thread":
+        state = ConvertState(
+            filters, interwikimap, namespaces, time_budget, stage_times, collect_names
+        )
+        pool = multiprocessing.pool.ThreadPool(processes)
+        convert_batch = functools.partial(safe_convert_batch, state=state)
+    else:
+        if shared_memory:
+            slots = sharedmem.Slots(max_pending, shared_memory)
+            convert_batch = safe_convert_shared_batch
+        else:
+            convert_batch = safe_convert_batch
+        pool = multiprocessing.Pool(
+            processes,
+            process_initializer,
+            [
+                filters,
+                interwikimap,
+                namespaces,
+                time_budget,
+                stage_times,
+                profile_dir,
+                collect_names,
+            ],
+        )
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for results, stats, batch_names, seconds in imap(
+            convert_batch, limited(batches(articles, BATCH_SIZE))
+        ):
+            if slots is not None:
+                results = slots.unpack(results)
+            if stats is not None:
+                stage_stats.merge(stats)
+            if batch_names is not None:
+                used_names.merge(batch_names)
+            if progress is not None:
+                progress.batch_done(seconds)
+            pending.release()
+            yield from results
+        # let workers exit normally, running their exit handlers
+        # such as the one saving profiler stats
+        pool.close()
+        pool.join()
+    finally:
+        # pool's task handler thread may be waiting for semaphore,
+        # let it go so that terminate() can join it
+        closed = True
+        for _ in range(max_pending):
+            try:
+                pending.release()
+            except ValueError:
+                break
+        pool.terminate()
+        if slots is not None:
+            slots.close()
+
+
+def stream(
+    articles: Iterable[convert.ConvertParams],
+    info: si.Info,
+    filters: Iterable[str] = (),
+    workers: Optional[int] = None,
+    time_budget=Defaults.time_budget,
+    max_pending: Optional[int] = None,
+    executor=Defaults.executor,
+    shared_memory=Defaults.shared_memory,
+) -> Iterator[Result]:
+    """
+    Convert articles, such as produced by dump.articles() or
+    scrape.articles(), and yield (title, aliases, html, error) as
+    they are converted, without creating slob. html is empty bytes
+    for article without text and None if conversion failed, with
+    error set to error message. Results come in no particular
+    order. Conversion stops when generator is closed.
+
+        info = siteinfo.info(siteinfo_dict)
+        for title, aliases, html, error in mw2slob.stream(
+            dump.articles(dump_files, info), info, filters, workers=8
+        ):
+            ...
+    """
+    return convert_all(
+        articles,
+        filters,
+        info.interwikimap,
+        info.namespaces,
+        processes=workers,
+        time_budget=time_budget,
+        max_pending=max_pending,
+        executor=executor,
+        shared_memory=shared_memory,
+    )
+
+
+def content_digest(text: bytes) -> bytes:
+    """
+    Digest of converted article. Whole output counts: article header
+    has article's title and link to online version, so articles with
+    same content but different titles aren't duplicates.
+
+    >>> content_digest(b"abc") == content_digest(b"abc")
+    True
+    >>> content_digest(b"abc") == content_digest(b"abcd")
+    False
+    """
+    return hashlib.blake2b(text, digest_size=16).digest()
+
+
+class ContentIndex:
+    """
+    Finds articles with converted content identical to that of an
+    article added earlier, such as same article repeated in dump.
+    """
+
+    def __init__(self):
+        # content digest -> title of article first added with this content
+        self.titles: Dict[bytes, str] = {}
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    def find(self, title: str, text: bytes) -> Optional[str]:
+        digest = content_digest(text)
+        target = self.titles.get(digest)
+        if target is None:
+            self.titles[digest] = title
+        else:
+            self.duplicates += 1
+            self.bytes_saved += len(text)
+        return target
+
+    def summary(self) -> str:
+        return (
+            f"Added {self.duplicates} articles with duplicate content as aliases, "
+            f"saved {self.bytes_saved} bytes"
+        )
+
+
+def add_results(
+    slb: slob.Writer,
+    results: Iterable[Result],
     html_encoding: str,
+    alias_index: Optional[AliasIndex] = None,
+    content_index: Optional[ContentIndex] = None,
+    used_names: Optional[cssprune.UsedNames] = None,
+    verbose=Defaults.verbose,
+    progress: Optional[Progress] = None,
+    failed: Optional[quarantine.Quarantine] = None,
 ):
-    pool = multiprocessing.Pool(
-        None,
-        process_initializer,
-        [filters, interwikimap, namespaces],
-    )
+    """
+    Add conversion results to slob. With content_index, duplicate
+    article is added as aliases of article added earlier (except for
+    its own title, if that's target's title too). used_names, if given,
+    is updated with names used in added articles, for results that
+    weren't converted by convert_all() collecting them.
+
+    >>> class Writer:
+    ...     def add(self, text, *keys, content_type=""):
+    ...         print("add", text, keys)
+    ...     def add_alias(self, key, target):
+    ...         print("alias", key, target)
+    >>> results = [
+    ...     ("A", ["A1"], b"<p>x</p>", None),
+    ...     ("B", ["B1"], b"<p>x</p>", None),
+    ...     ("A", ["A2"], b"<p>x</p>", None),
+    ...     ("C", [], b"<p>y</p>", None),
+    ... ]
+    >>> add_results(Writer(), results, "utf-8", content_index=ContentIndex())
+    add b'<p>x</p>' ('A', 'A1')
+    S A (8)
+    alias B A
+    alias B1 A
+    D B = A
+    alias A2 A
+    D A = A
+    add b'<p>y</p>' ('C',)
+    S C (8)
+    """
     html_content_type = HTML_CHARSET_TMPL.format(html_encoding)
-    try:
-        resulti = pool.imap_unordered(safe_convert, articles, chunksize=100)
-        for title, aliases, text, error in resulti:
-            if error:
+    for title, aliases, text, error in results:
+        if error:
+            if failed is not None:
+                failed.add(title, error)
+            if progress is not None:
+                progress.failed += 1
+            if verbose:
                 print(f"F {title}")
-            else:
-                if text:
+        else:
+            if text:
+                if used_names is not None:
+                    used_names.update(text.decode(html_encoding, errors="replace"))
+                if alias_index is None:
                     keys = [title]
                     if aliases:
                         keys += aliases
+                else:
+                    keys = alias_index.keys(title, aliases)
+                target = None
+                if content_index is not None:
+                    target = content_index.find(title, text)
+                if target is None:
                     slb.add(text, *keys, content_type=html_content_type)
-                    print(f"S {title} ({len(text)})")
+                    if progress is not None:
+                        progress.stored += 1
+                        progress.output_bytes += len(text)
+                    if verbose:
+                        print(f"S {title} ({len(text)})")
                 else:
+                    for key in keys:
+                        if key != target:
+                            slb.add_alias(key, target)
+                    if progress is not None:
+                        progress.duplicates += 1
+                    if verbose:
+                        print(f"D {title} = {target}")
+            else:
+                if progress is not None:
+                    progress.empty += 1
+                if verbose:
                     print(f"E {title}")
+
+
+def run(
+    slb: slob.Writer,
+    articles: Iterable[convert.ConvertParams],
+    filters: Iterable[str],
+    interwikimap: Iterable[Mapping[str, str]],
+    namespaces: Mapping[str, dict],
+    html_encoding: str,
+    converted: Optional[Iterable[Result]] = None,
+    alias_index: Optional[AliasIndex] = None,
+    content_index: Optional[ContentIndex] = None,
+    used_names: Optional[cssprune.UsedNames] = None,
+    time_budget=Defaults.time_budget,
+    executor=Defaults.executor,
+    shared_memory=Defaults.shared_memory,
+    stage_stats: Optional[StageStats] = None,
+    profile_dir=Defaults.profile_dir,
+    verbose=Defaults.verbose,
+    progress: Optional[Progress] = None,
+    failed: Optional[quarantine.Quarantine] = None,
+):
+    if converted is None:
+        results = convert_all(
+            articles,
+            filters,
+            interwikimap,
+            namespaces,
+            time_budget=time_budget,
+            executor=executor,
+            shared_memory=shared_memory,
+            stage_stats=stage_stats,
+            profile_dir=profile_dir,
+            progress=progress,
+            # which aliases are dropped depends on order articles are added in
+            ordered=alias_index is not None,
+            used_names=used_names,
+        )
+    else:
+        results = converted
+    try:
+        add_results(
+            slb,
+            results,
+            html_encoding,
+            alias_index=alias_index,
+            content_index=content_index,
+            # names in articles converted here are collected by workers
+            used_names=used_names if converted is not None else None,
+            verbose=verbose,
+            progress=progress,
+            failed=failed,
+        )
     except KeyboardInterrupt:
         log.warn("User interrupted")
     except:
         log.exception("")
         raise
     finally:
-        pool.terminate()
+        if converted is None:
+            # terminates conversion pool
+            results.close()
+
+
+def add_pruned_css(
+    slb: slob.Writer, content_dir: str, used_names: cssprune.UsedNames
+):
+    css_dir = os.path.join(content_dir, "css")
+    for name in sorted(os.listdir(css_dir)):
+        with open(os.path.join(css_dir, name), encoding="utf-8") as f:
+            css = f.read()
+        if name in cssprune.PRUNED_STYLESHEETS:
+            content = cssprune.prune_stylesheet(css, used_names)
+            original_size = len(css.encode("utf-8"))
+            p(f"\nPruned {name} from {original_size} to {len(content)} bytes")
+        else:
+            content = css.encode("utf-8")
+        slb.add(content, f"~/css/{name}", content_type="text/css")
 
 
 def create_slob(
@@ -171,9 +621,32 @@ def create_slob(
     tags: Optional[Mapping[str, str]] = None,
     html_encoding=Defaults.html_encoding,
     filters: Iterable[str] = (),
+    converted: Optional[Iterable[Result]] = None,
+    dedupe_aliases=Defaults.dedupe_aliases,
+    dedupe_content=Defaults.dedupe_content,
+    prune_css=Defaults.prune_css,
+    time_budget=Defaults.time_budget,
+    executor=Defaults.executor,
+    shared_memory=Defaults.shared_memory,
+    stage_times=Defaults.stage_times,
+    profile_dir=Defaults.profile_dir,
+    verbose=Defaults.verbose,
+    progress: Optional[Progress] = None,
+    quarantine_file=Defaults.quarantine,
 ):
 
-    with slob.create(
+    alias_index = AliasIndex() if dedupe_aliases else None
+    stage_stats = StageStats() if stage_times else None
+    content_index = ContentIndex() if dedupe_content else None
+    used_names = cssprune.UsedNames() if prune_css else None
+    if progress is not None:
+        observer = progress.observer(observer)
+
+    with started(progress), profiling.profile(
+        profile_dir
+    ), quarantine.opened(
+        quarantine_file
+    ) as failed, slob.create(
         outname,
         compression=compression,
         workdir=workdir,
@@ -194,7 +667,36 @@ def create_slob(
             for (name, value) in tags.items():
                 slb.tag(name, value)
 
-        run(slb, articles, filters, info.interwikimap, info.namespaces, html_encoding)
+        run(
+            slb,
+            articles,
+            filters,
+            info.interwikimap,
+            info.namespaces,
+            html_encoding,
+            converted=converted,
+            alias_index=alias_index,
+            content_index=content_index,
+            used_names=used_names,
+            time_budget=time_budget,
+            executor=executor,
+            shared_memory=shared_memory,
+            stage_stats=stage_stats,
+            profile_dir=profile_dir,
+            verbose=verbose,
+            progress=progress,
+            failed=failed,
+        )
+
+        if failed is not None:
+            failed.close()
+            p(f"\n{failed.summary()}")
+        if alias_index is not None:
+            p(f"\n{alias_index.summary()}")
+        if stage_stats is not None:
+            p(f"\n{stage_stats.report()}")
+        if content_index is not None:
+            p(f"\n{content_index.summary()}")
 
         include_built_in = {"js", "css", "images"}
 
@@ -202,6 +704,9 @@ def create_slob(
             include_built_in.add("MathJax")
 
         content_dir = os.path.dirname(__file__)
+        if used_names is not None:
+            include_built_in.remove("css")
+            add_pruned_css(slb, content_dir, used_names)
         slob.add_dir(slb, content_dir, include_only=include_built_in, prefix="~/")
         if content_dirs:
             for content_dir in content_dirs:
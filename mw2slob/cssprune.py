@@ -0,0 +1,143 @@
+import logging
+import re
+from typing import Set
+
+import cssutils
+
+# Stylesheets that come from MediaWiki and mostly style things that
+# don't occur in any given wiki
+PRUNED_STYLESHEETS = ("mediawiki_monobook.css", "mediawiki_shared.css")
+
+# present in every page article reader shows, whether in articles or not
+ALWAYS_USED_TAGS = {"html", "head", "body"}
+
+TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)")
+CLASS_ATTR_RE = re.compile(r'\sclass="([^"]*)"')
+ID_ATTR_RE = re.compile(r'\sid="([^"]*)"')
+
+# parts of selector that don't require anything to be present in document:
+# attribute selectors and arguments of functional pseudo-classes
+# such as :not(.x)
+SELECTOR_IGNORED_RE = re.compile(r"\[[^\]]*\]|\([^)]*\)")
+SELECTOR_NAME_RE = re.compile(r"([#.]?)(-?[_a-zA-Z][_a-zA-Z0-9-]*)")
+SELECTOR_PSEUDO_RE = re.compile(r"::?-?[_a-zA-Z][_a-zA-Z0-9-]*")
+
+
+class UsedNames:
+    """
+    Element names, classes and ids that occur in converted articles.
+
+    >>> used = UsedNames()
+    >>> used.update('<div class="a  b" id="x"><P class="c">t</P></div>')
+    >>> sorted(used.tags), sorted(used.classes), sorted(used.ids)
+    (['body', 'div', 'head', 'html', 'p'], ['a', 'b', 'c'], ['x'])
+    """
+
+    def __init__(self):
+        self.tags: Set[str] = set(ALWAYS_USED_TAGS)
+        self.classes: Set[str] = set()
+        self.ids: Set[str] = set()
+
+    def update(self, html: str):
+        self.tags.update(tag.lower() for tag in TAG_RE.findall(html))
+        for value in CLASS_ATTR_RE.findall(html):
+            self.classes.update(value.split())
+        self.ids.update(ID_ATTR_RE.findall(html))
+
+    def merge(self, other: "UsedNames"):
+        """
+        >>> used, other = UsedNames(), UsedNames()
+        >>> other.update('<b class="x" id="y">t</b>')
+        >>> used.merge(other)
+        >>> "b" in used.tags, sorted(used.classes), sorted(used.ids)
+        (True, ['x'], ['y'])
+        """
+        self.tags.update(other.tags)
+        self.classes.update(other.classes)
+        self.ids.update(other.ids)
+
+    def may_match(self, selector: str) -> bool:
+        """
+        Whether selector may match an element in converted articles.
+        Classes, ids and element names it requires must have been
+        seen in some article, attribute selectors and pseudo-classes
+        aren't checked.
+
+        >>> used = UsedNames()
+        >>> used.update('<table class="wikitable"><td id="x">t</td></table>')
+        >>> used.may_match("table.wikitable td")
+        True
+        >>> used.may_match(".wikitable > tr:first-child")
+        False
+        >>> used.may_match("body.rtl .wikitable")
+        False
+        >>> used.may_match("#x:not(.y)::before")
+        True
+        >>> used.may_match("a[href^='http']")
+        False
+        >>> used.may_match("*[dir=rtl] #x")
+        True
+        """
+        if "\\" in selector:
+            # escapes, don't bother
+            return True
+        selector = SELECTOR_IGNORED_RE.sub("", selector)
+        selector = SELECTOR_PSEUDO_RE.sub("", selector)
+        for prefix, name in SELECTOR_NAME_RE.findall(selector):
+            if prefix == ".":
+                if name not in self.classes:
+                    return False
+            elif prefix == "#":
+                if name not in self.ids:
+                    return False
+            elif name.lower() not in self.tags:
+                return False
+        return True
+
+
+def prune_rules(rules, used: UsedNames):
+    for rule in list(rules):
+        if rule.type == rule.STYLE_RULE:
+            selectors = [
+                selector.selectorText
+                for selector in rule.selectorList
+                if used.may_match(selector.selectorText)
+            ]
+            if selectors:
+                if len(selectors) < len(rule.selectorList):
+                    rule.selectorText = ", ".join(selectors)
+            else:
+                rules.remove(rule)
+        elif rule.type == rule.MEDIA_RULE:
+            prune_rules(rule.cssRules, used)
+            if not len(rule.cssRules):
+                rules.remove(rule)
+        elif rule.type == rule.COMMENT:
+            rules.remove(rule)
+
+
+def prune_stylesheet(css: str, used: UsedNames) -> bytes:
+    """
+    Remove rules that can't match anything in converted articles.
+
+    >>> used = UsedNames()
+    >>> used.update('<table class="wikitable"><td>t</td></table>')
+    >>> print(prune_stylesheet('''
+    ... /* comment */
+    ... .wikitable td, .infobox td { padding: 0 }
+    ... .infobox { float: right }
+    ... @media screen { .infobox { float: none } td { color: red } }
+    ... ''', used).decode())
+    .wikitable td {
+        padding: 0
+        }
+    @media screen {
+        td {
+            color: red
+            }
+        }
+    """
+    parser = cssutils.CSSParser(loglevel=logging.CRITICAL, validate=False)
+    sheet = parser.parseString(css)
+    prune_rules(sheet.cssRules, used)
+    return sheet.cssText
@@ -0,0 +1,468 @@
+import collections
+import json
+import logging
+import os
+import pickle
+import secrets
+import socket
+import threading
+import time
+from multiprocessing import Process
+from multiprocessing.connection import Client
+from multiprocessing.connection import Connection
+from multiprocessing.connection import Listener
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from . import core
+from . import dump
+from . import siteinfo as si
+
+log = logging.getLogger(__name__)
+
+# Coordinator splits dump files into byte ranges (tasks) and hands them
+# out to workers connected over TCP, in dump order. Each worker converts
+# its range with a local process pool into a spill file - pickled
+# conversion results - and uploads it back. Workers keep dump files open
+# between ranges (see dump.RangeReader), so each worker reads through a
+# dump once. When all ranges are done coordinator feeds spill files, in
+# dump order, into core.create_slob.
+
+Task = collections.namedtuple(
+    "Task", ["task_id", "dump_file", "file_number", "start", "end"]
+)
+
+# seconds idle worker waits before asking for a task again when all
+# remaining tasks are assigned to other workers
+WAIT_INTERVAL = 5
+
+# seconds without word from worker after which its task is handed out
+# to another worker, and how often worker reports progress
+LEASE_TIMEOUT = 600
+HEARTBEAT_INTERVAL = 60
+
+CONNECT_ATTEMPTS = 12
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+JOB_FILE_NAME = "job.json"
+
+
+def parse_address(s: str) -> Tuple[str, int]:
+    """
+    >>> parse_address("localhost:8765")
+    ('localhost', 8765)
+    >>> parse_address(":8765")
+    ('', 8765)
+    """
+    host, port = s.rsplit(":", 1)
+    return host, int(port)
+
+
+def mk_tasks(
+    dump_files: Sequence[str], range_size: Optional[int] = None
+) -> List[Task]:
+    """
+    Split each file of dump files into ranges of range_size bytes (or
+    one range per file).
+    """
+    tasks = []
+    for dump_file in dump_files:
+        print(f"Reading file sizes in {dump_file}")
+        for k, size in enumerate(dump.member_sizes(dump_file)):
+            step = range_size or size
+            for start in range(0, size, step):
+                tasks.append(
+                    Task(
+                        task_id=len(tasks),
+                        dump_file=dump_file,
+                        file_number=k + 1,
+                        start=start,
+                        end=min(start + step, size),
+                    )
+                )
+    return tasks
+
+
+def write_spill(path: str, results: Iterable[core.Result]) -> int:
+    count = 0
+    with open(path, "wb") as f:
+        for result in results:
+            pickle.dump(tuple(result), f, pickle.HIGHEST_PROTOCOL)
+            count += 1
+    return count
+
+
+def read_spill(path: str) -> Iterator[core.Result]:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+
+def spill_name(task: Task) -> str:
+    return f"{task.task_id:06d}.spill"
+
+
+class Coordinator:
+    def __init__(
+        self,
+        job: Mapping[str, Any],
+        tasks: List[Task],
+        spill_dir: str,
+        lease_timeout: float = LEASE_TIMEOUT,
+    ):
+        self.job = job
+        self.tasks = tasks
+        self.spill_dir = spill_dir
+        self.lease_timeout = lease_timeout
+        self.pending = collections.deque()
+        # worker each task is assigned to and when its lease expires
+        self.assigned: Dict[int, Tuple[str, float]] = {}
+        self.done = set()
+        self.lock = threading.Condition()
+        for task in tasks:
+            if os.path.exists(self.spill_path(task)):
+                self.done.add(task.task_id)
+            else:
+                self.pending.append(task)
+
+    def spill_path(self, task: Task) -> str:
+        return os.path.join(self.spill_dir, spill_name(task))
+
+    def upload_path(self, task: Task, worker: str) -> str:
+        # task handed out again after its lease expired can be uploaded
+        # by two workers at once
+        return f"{self.spill_path(task)}.{worker.replace(':', '-')}.part"
+
+    def is_complete(self) -> bool:
+        return len(self.done) == len(self.tasks)
+
+    def next_task(self, worker: str):
+        with self.lock:
+            now = time.monotonic()
+            if self.pending:
+                task = self.pending.popleft()
+            else:
+                task = self.expired_task(now)
+                if task is None:
+                    return ("done",) if self.is_complete() else ("wait",)
+            self.assigned[task.task_id] = (worker, now + self.lease_timeout)
+            return ("task", task)
+
+    def expired_task(self, now: float) -> Optional[Task]:
+        for task_id, (assignee, expires) in self.assigned.items():
+            if expires < now:
+                log.warning(
+                    "Worker %s didn't report on task %s for %s seconds, "
+                    "task will be reassigned",
+                    assignee,
+                    task_id,
+                    self.lease_timeout,
+                )
+                return self.tasks[task_id]
+        return None
+
+    def renew(self, task_id: int, worker: str):
+        with self.lock:
+            if self.assigned.get(task_id, (None,))[0] == worker:
+                expires = time.monotonic() + self.lease_timeout
+                self.assigned[task_id] = (worker, expires)
+
+    def release(self, worker: str):
+        with self.lock:
+            for task_id, (assignee, _) in list(self.assigned.items()):
+                if assignee == worker:
+                    del self.assigned[task_id]
+                    log.warning(
+                        "Worker %s disconnected, task %s will be reassigned",
+                        worker,
+                        task_id,
+                    )
+                    self.pending.appendleft(self.tasks[task_id])
+
+    def finish(self, task: Task, worker: str, count: int):
+        with self.lock:
+            upload_path = self.upload_path(task, worker)
+            if task.task_id in self.done:
+                # another worker finished it first
+                os.remove(upload_path)
+                return
+            os.replace(upload_path, self.spill_path(task))
+            self.assigned.pop(task.task_id, None)
+            self.done.add(task.task_id)
+            print(
+                f"Worker {worker} finished {task.dump_file} "
+                f"{task.file_number}@{task.start}-{task.end} ({count}), "
+                f"{len(self.done)}/{len(self.tasks)} done",
+                flush=True,
+            )
+            self.lock.notify_all()
+
+    def handle(self, conn: Connection):
+        worker = None
+        upload = None
+        try:
+            _, worker = conn.recv()
+            conn.send(("job", self.job))
+            while True:
+                msg = conn.recv()
+                kind = msg[0]
+                if kind == "next":
+                    conn.send(self.next_task(worker))
+                elif kind == "alive":
+                    _, task_id = msg
+                    self.renew(task_id, worker)
+                elif kind == "chunk":
+                    _, task_id, data = msg
+                    self.renew(task_id, worker)
+                    if upload is None:
+                        upload_path = self.upload_path(self.tasks[task_id], worker)
+                        upload = open(upload_path, "wb")
+                    upload.write(data)
+                elif kind == "finished":
+                    _, task_id, count = msg
+                    if upload is None:
+                        upload_path = self.upload_path(self.tasks[task_id], worker)
+                        upload = open(upload_path, "wb")
+                    upload.close()
+                    upload = None
+                    self.finish(self.tasks[task_id], worker, count)
+        except (EOFError, OSError):
+            pass
+        except Exception:
+            log.exception("Worker %s failed", worker)
+        finally:
+            if upload is not None:
+                upload.close()
+            conn.close()
+            if worker:
+                self.release(worker)
+
+    def start(self, address: Tuple[str, int], authkey: bytes):
+        self.listener = listener = Listener(address, authkey=authkey)
+
+        def accept():
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception:
+                    if self.is_complete():
+                        # listener closed
+                        break
+                    # failed authentication and such
+                    log.exception("Failed to accept worker connection")
+                    continue
+                thread = threading.Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+
+        accept_thread = threading.Thread(target=accept)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+    def wait(self):
+        with self.lock:
+            while not self.is_complete():
+                self.lock.wait()
+        self.listener.close()
+
+
+def prepare_spill_dir(spill_dir: str, job: Mapping[str, Any]):
+    os.makedirs(spill_dir, exist_ok=True)
+    job_path = os.path.join(spill_dir, JOB_FILE_NAME)
+    job_json = json.dumps(job, sort_keys=True)
+    if os.path.exists(job_path):
+        with open(job_path) as f:
+            if f.read() != job_json:
+                log.warning(
+                    "Spill files in %s are for a different job, removing", spill_dir
+                )
+                for name in os.listdir(spill_dir):
+                    if name.endswith(".spill") or name.endswith(".part"):
+                        os.remove(os.path.join(spill_dir, name))
+    with open(job_path, "w") as f:
+        f.write(job_json)
+
+
+def remove_spill_dir(spill_dir: str):
+    for name in os.listdir(spill_dir):
+        os.remove(os.path.join(spill_dir, name))
+    os.rmdir(spill_dir)
+
+
+def coordinate(
+    address: Tuple[str, int],
+    authkey: Optional[bytes],
+    job: Mapping[str, Any],
+    spill_dir: str,
+    range_size: Optional[int] = None,
+    local_workers: int = 0,
+    executor: str = core.Defaults.executor,
+    shared_memory: int = core.Defaults.shared_memory,
+    lease_timeout: float = LEASE_TIMEOUT,
+) -> List[str]:
+    """
+    Distribute conversion of dump files, in ranges of range_size bytes,
+    to workers and return paths of resulting spill files, in dump
+    order. Task of worker that doesn't report for lease_timeout seconds
+    is handed out again.
+    """
+    if authkey is None:
+        authkey = secrets.token_hex(16).encode()
+    # spill files are named by task id, tasks depend on range size
+    prepare_spill_dir(spill_dir, {**job, "range_size": range_size})
+    tasks = mk_tasks(job["dump_files"], range_size=range_size)
+    coordinator = Coordinator(job, tasks, spill_dir, lease_timeout=lease_timeout)
+    coordinator.start(address, authkey)
+    # actual port if given port is 0
+    port = coordinator.listener.address[1]
+    host = address[0]
+    print(
+        f"Distributing {len(coordinator.pending)} of {len(tasks)} ranges, "
+        f"start workers with:\n"
+        f"  MW2SLOB_AUTHKEY={authkey.decode()} "
+        f"mw2slob worker {host or socket.getfqdn()}:{port}",
+        flush=True,
+    )
+    processes = []
+    if local_workers:
+        worker_processes = max(1, (os.cpu_count() or 1) // local_workers)
+        local_host = "localhost" if host in ("", "0.0.0.0", "::") else host
+        for _ in range(local_workers):
+            process = Process(
+                target=work,
+                args=((local_host, port), authkey),
+                kwargs=dict(
+                    workdir=spill_dir,
+                    processes=worker_processes,
+                    executor=executor,
+                    shared_memory=shared_memory,
+                ),
+            )
+            process.start()
+            processes.append(process)
+    try:
+        coordinator.wait()
+    finally:
+        for process in processes:
+            process.join(WAIT_INTERVAL * 2)
+            if process.is_alive():
+                process.terminate()
+    return [coordinator.spill_path(task) for task in tasks]
+
+
+def read_spills(paths: Iterable[str]) -> Iterator[core.Result]:
+    for path in paths:
+        yield from read_spill(path)
+
+
+def heartbeat(
+    results: Iterable[core.Result], conn: Connection, task_id: int
+) -> Iterator[core.Result]:
+    """
+    Pass results through, telling coordinator every HEARTBEAT_INTERVAL
+    seconds that task is still being worked on. Worker stuck on a task
+    stops producing results, so its lease expires.
+    """
+    last = time.monotonic()
+    for result in results:
+        now = time.monotonic()
+        if now - last >= HEARTBEAT_INTERVAL:
+            conn.send(("alive", task_id))
+            last = now
+        yield result
+
+
+def work(
+    address: Tuple[str, int],
+    authkey: bytes,
+    workdir: str = ".",
+    processes: Optional[int] = None,
+    dump_dir: Optional[str] = None,
+    executor: str = core.Defaults.executor,
+    shared_memory: int = core.Defaults.shared_memory,
+):
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            conn = Client(address, authkey=authkey)
+        except ConnectionRefusedError:
+            # coordinator may not be listening yet
+            if attempt == CONNECT_ATTEMPTS - 1:
+                raise
+            time.sleep(WAIT_INTERVAL)
+        else:
+            break
+    conn.send(("hello", name))
+    _, job = conn.recv()
+    info = si.info(job["siteinfo"], job["local_namespaces"])
+    # dump file readers kept open between tasks
+    readers: Dict[str, dump.RangeReader] = {}
+    try:
+        while True:
+            conn.send(("next",))
+            try:
+                reply = conn.recv()
+            except EOFError:
+                # coordinator got all results and exited
+                break
+            if reply[0] == "done":
+                break
+            if reply[0] == "wait":
+                time.sleep(WAIT_INTERVAL)
+                continue
+            task: Task = reply[1]
+            dump_file = task.dump_file
+            if dump_dir:
+                dump_file = os.path.join(dump_dir, os.path.basename(dump_file))
+            if dump_file not in readers:
+                readers[dump_file] = dump.RangeReader(dump_file)
+            articles = dump.range_articles(
+                readers[dump_file],
+                task.file_number,
+                task.start,
+                task.end,
+                info,
+                html_encoding=job["html_encoding"],
+                remove_embedded_bg=job["remove_embedded_bg"],
+                ensure_ext_image_urls=job["ensure_ext_image_urls"],
+                minify=job["minify"],
+                verbose=False,
+            )
+            results = core.convert_all(
+                articles,
+                job["filters"],
+                info.interwikimap,
+                info.namespaces,
+                processes=processes,
+                time_budget=job["time_budget"],
+                executor=executor,
+                shared_memory=shared_memory,
+            )
+            spill_path = os.path.join(
+                workdir, f"{name.replace(':', '-')}.{task.task_id:06d}.upload"
+            )
+            try:
+                count = write_spill(
+                    spill_path, heartbeat(results, conn, task.task_id)
+                )
+                with open(spill_path, "rb") as f:
+                    for data in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                        conn.send(("chunk", task.task_id, data))
+                conn.send(("finished", task.task_id, count))
+            finally:
+                os.remove(spill_path)
+    finally:
+        for reader in readers.values():
+            reader.close()
+    conn.close()
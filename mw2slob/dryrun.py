@@ -0,0 +1,291 @@
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Mapping
+from typing import Optional
+
+from . import convert
+from . import core
+from . import progress
+from . import siteinfo as si
+from . import sizereport
+
+# articles are stratified by size: stratum n has articles of up to
+# 2 ** (n + STRATUM_MIN_BITS) characters, last one everything larger
+STRATUM_MIN_BITS = 10
+STRATA = 12
+
+# memory per key kept in alias index with dedupe_aliases (key string,
+# set or dict entry) and, with dedupe_content, per article in content
+# index, bytes
+ALIAS_INDEX_BYTES = 200
+CONTENT_INDEX_BYTES = 250
+
+
+def stratum(size: int) -> int:
+    """
+    >>> [stratum(n) for n in (0, 1024, 1025, 5000, 10 ** 9)]
+    [0, 0, 1, 3, 11]
+    """
+    return min(max(0, (size - 1).bit_length() - STRATUM_MIN_BITS), STRATA - 1)
+
+
+class StratifiedSample:
+    """
+    Uniform random sample (reservoir) of each article size stratum,
+    holding at most size articles in total, and counts of all
+    articles seen in each stratum.
+
+    >>> sample = StratifiedSample(4, seed=1)
+    >>> for n in range(100):
+    ...     sample.add(n, 500 if n % 10 else 5000)
+    >>> sorted(sample.counts.items())
+    [(0, 90), (3, 10)]
+    >>> sorted((s, len(items)) for s, items in sample.reservoirs.items())
+    [(0, 2), (3, 2)]
+    """
+
+    def __init__(self, size: int, seed=None):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.counts: Dict[int, int] = {}
+        self.reservoirs: Dict[int, list] = {}
+        # strata share sample equally as far as they have articles,
+        # so that rare large articles are well represented (estimates
+        # weigh strata by counts), capacity only ever shrinks
+        self.capacities: Dict[int, int] = {}
+
+    def add(self, item, size: int):
+        s = stratum(size)
+        seen = self.counts[s] = self.counts.get(s, 0) + 1
+        reservoir = self.reservoirs.setdefault(s, [])
+        capacity = self.capacities.setdefault(s, self.size)
+        if len(reservoir) < capacity:
+            reservoir.append(item)
+            self.trim()
+        else:
+            i = self.rng.randrange(seen)
+            if i < capacity:
+                reservoir[i] = item
+
+    def trim(self):
+        if sum(len(r) for r in self.reservoirs.values()) <= self.size:
+            return
+        s, largest = max(self.reservoirs.items(), key=lambda item: len(item[1]))
+        # dropping random item leaves uniform sample of stratum
+        largest.pop(self.rng.randrange(len(largest)))
+        self.capacities[s] = len(largest)
+
+
+def random_sample(items: Iterable, size: int, seed=None) -> list:
+    """
+    Uniform random sample (reservoir) of at most size items, in input
+    order. Unlike StratifiedSample, every item is equally likely to be
+    in it, so totals and ratios measured on sample aren't skewed
+    towards large articles.
+
+    >>> random_sample(range(3), 5)
+    [0, 1, 2]
+    >>> sample = random_sample(range(1000), 10, seed=1)
+    >>> len(sample), sample == sorted(sample)
+    (10, True)
+    """
+    rng = random.Random(seed)
+    reservoir: list = []
+    for i, item in enumerate(items):
+        if len(reservoir) < size:
+            reservoir.append((i, item))
+        else:
+            j = rng.randrange(i + 1)
+            if j < size:
+                reservoir[j] = (i, item)
+    return [item for _, item in sorted(reservoir, key=lambda entry: entry[0])]
+
+
+class StratumResult:
+    def __init__(self, count: int):
+        # articles in stratum in whole input
+        self.count = count
+        self.sampled = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.input_chars = 0
+        self.outputs: List[bytes] = []
+
+    def scale(self) -> float:
+        return self.count / self.sampled if self.sampled else 0.0
+
+
+def convert_sample(
+    sample: StratifiedSample,
+    filters: Iterable[str],
+    interwikimap: Iterable[Mapping[str, str]],
+    namespaces: Mapping[str, dict],
+    time_budget: Optional[float],
+) -> Dict[int, StratumResult]:
+    """
+    Convert sample articles in one worker process, one after another,
+    so that time of each conversion is what it takes on one CPU.
+    """
+    results = {}
+    articles = []
+    for s, reservoir in sorted(sample.reservoirs.items()):
+        results[s] = StratumResult(sample.counts[s])
+        articles.extend((s, params) for params in reservoir)
+    pool = multiprocessing.Pool(
+        1, core.process_initializer, [filters, interwikimap, namespaces, time_budget]
+    )
+    try:
+        batches = list(core.batches(articles, core.BATCH_SIZE))
+        converted = pool.imap(
+            core.safe_convert_batch,
+            ([params for _, params in batch] for batch in batches),
+        )
+        for batch, (batch_results, _, _, seconds) in zip(batches, converted):
+            for (s, params), result, article_seconds in zip(
+                batch, batch_results, seconds
+            ):
+                stratum_result = results[s]
+                stratum_result.sampled += 1
+                stratum_result.seconds += article_seconds
+                stratum_result.input_chars += len(params.text or "")
+                _, _, html, error = result
+                if error:
+                    stratum_result.failed += 1
+                elif html:
+                    stratum_result.outputs.append(html)
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+    return results
+
+
+def mb(size: float) -> str:
+    return f"{size / 1e6:,.1f} MB"
+
+
+def duration(seconds: float) -> str:
+    """
+    >>> duration(3725.2)
+    '1:02:05'
+    """
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+def dry_run(
+    articles: Iterable[convert.ConvertParams],
+    info: si.Info,
+    filters: Iterable[str] = (),
+    sample_size: int = 1000,
+    time_budget=core.Defaults.time_budget,
+    executor=core.Defaults.executor,
+    min_bin_size=core.Defaults.min_bin_size,
+    dedupe_aliases=core.Defaults.dedupe_aliases,
+    dedupe_content=core.Defaults.dedupe_content,
+    seed=None,
+):
+    """
+    Read all articles, convert stratified random sample of them and
+    print projected conversion time, output size for each compression
+    and memory needed, without creating slob.
+    """
+    base_rss = progress.rss(os.getpid()) or 0
+    sample = StratifiedSample(sample_size, seed)
+    total = 0
+    aliases = 0
+    input_chars = 0
+    t0 = time.perf_counter()
+    for params in articles:
+        size = len(params.text or "")
+        total += 1
+        aliases += len(params.aliases or ())
+        input_chars += size
+        sample.add(params, size)
+    read_seconds = time.perf_counter() - t0
+    print(f"Read {total} articles ({mb(input_chars)}) in {duration(read_seconds)}")
+    if not total:
+        return
+
+    filters = list(filters)
+    results = convert_sample(
+        sample, filters, info.interwikimap, info.namespaces, time_budget
+    )
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rss_unit
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    workers = os.cpu_count() or 1
+    parallel = 1 if executor == "thread" and gil else workers
+
+    print(f"\n{'size up to':>12} {'articles':>10} {'sampled':>8} {'ms/article':>11}")
+    cpu_seconds = 0.0
+    output_bytes = 0.0
+    failed = 0.0
+    for s, r in sorted(results.items()):
+        cpu_seconds += r.seconds * r.scale()
+        output_bytes += sum(len(html) for html in r.outputs) * r.scale()
+        failed += r.failed * r.scale()
+        bound = "" if s == STRATA - 1 else f"{2 ** (s + STRATUM_MIN_BITS):,}"
+        per_article = r.seconds / r.sampled * 1000 if r.sampled else 0.0
+        print(f"{bound:>12} {r.count:>10} {r.sampled:>8} {per_article:>11.1f}")
+
+    convert_seconds = cpu_seconds / parallel
+    print(
+        f"\nConversion: {duration(cpu_seconds)} CPU time, "
+        f"{duration(convert_seconds)} with {executor} executor "
+        f"converting {parallel} at a time"
+    )
+    print(f"Failed to convert: about {failed:.0f} articles")
+    print(f"Converted HTML: {mb(output_bytes)}")
+
+    bin_size = min_bin_size * 1024
+    for name, compress in sizereport.COMPRESSIONS.items():
+        compressed = 0.0
+        compress_seconds = 0.0
+        for r in results.values():
+            t0 = time.perf_counter()
+            compressed += (
+                sizereport.compressed_size(r.outputs, compress, bin_size) * r.scale()
+            )
+            compress_seconds += (time.perf_counter() - t0) * r.scale()
+        # reading, conversion and compression (in main process, as
+        # articles are added) run at the same time, slowest one sets
+        # the pace; slob finalization (sorting keys, resolving
+        # aliases) comes on top and isn't estimated
+        projected = max(read_seconds, convert_seconds, compress_seconds)
+        print(
+            f"{name}: {mb(compressed)} compressed "
+            f"(compression {duration(compress_seconds)}), "
+            f"projected time {duration(projected)} plus finalization"
+        )
+
+    # parent holds up to two batches per worker, each as text and
+    # pickled for sending
+    mean_chars = input_chars / total
+    pending = 2 * workers * core.BATCH_SIZE * mean_chars * 2
+    indexes = 0
+    if dedupe_aliases:
+        indexes += (total + aliases) * ALIAS_INDEX_BYTES
+    if dedupe_content:
+        indexes += total * CONTENT_INDEX_BYTES
+    main_rss = base_rss + pending + indexes
+    worker_processes = 0 if executor == "thread" else workers
+    print(
+        f"\nMemory: main process about {mb(main_rss)} "
+        f"(pending batches {mb(pending)}, key indexes {mb(indexes)})"
+    )
+    if worker_processes:
+        print(
+            f"        {worker_processes} worker processes "
+            f"{mb(worker_rss)} each at most, "
+            f"{mb(main_rss + worker_processes * worker_rss)} in total"
+        )
@@ -1,3 +1,4 @@
+import contextlib
 import json
 import logging
 import os
@@ -5,6 +6,8 @@ import tarfile
 from io import TextIOWrapper
 from typing import IO
 from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
 from typing import Sequence
 from typing import Tuple
@@ -52,6 +55,197 @@ def get_siteinfo(args):
     return siteinfo_dict
 
 
+class ReadPosition:
+    """
+    How much of dump files (compressed, if they are) has been read,
+    for progress estimates.
+    """
+
+    def __init__(self, dump_files: Iterable[str]):
+        self.total = sum(os.path.getsize(os.path.expanduser(f)) for f in dump_files)
+        # bytes in dump files read completely
+        self.done = 0
+        # binary file object of dump file being read
+        self.current: Optional[IO[bytes]] = None
+
+    def fraction(self) -> float:
+        current = self.current
+        position = self.done
+        if current is not None:
+            try:
+                position += current.tell()
+            except (OSError, ValueError):
+                # closed
+                pass
+        return min(position / self.total, 1.0) if self.total else 1.0
+
+    def finish_file(self, dump_file: str):
+        self.done += os.path.getsize(dump_file)
+        self.current = None
+
+
+@contextlib.contextmanager
+def open_dump(
+    dump_file: str,
+    position: Optional[ReadPosition] = None,
+    binary: bool = False,
+) -> Iterator[Iterable[Union[TextIOWrapper, IO[bytes]]]]:
+    """
+    Yield files with article lines contained in dump file: each member of
+    a .tar or .tar.gz archive, or the dump file itself otherwise. Files
+    are numbered from 1 in location specs. If position is given, it is
+    updated as dump file is read. With binary, dump file that isn't an
+    archive is opened in binary mode too.
+    """
+    if dump_file.endswith(".tar.gz") or dump_file.endswith(".tar"):
+        with open(dump_file, "rb") as raw:
+            mode = "r:gz" if dump_file.endswith(".tar.gz") else "r"
+            with tarfile.open(fileobj=raw, mode=mode) as tar:
+                if position is not None:
+                    position.current = raw
+                yield (
+                    f
+                    for f in (tar.extractfile(member) for member in tar)
+                    if f is not None
+                )
+    elif binary:
+        with open(dump_file, "rb") as f:
+            if position is not None:
+                position.current = f
+            yield [f]
+    else:
+        with open(dump_file) as f:
+            if position is not None:
+                position.current = f.buffer
+            yield [f]
+    if position is not None:
+        position.finish_file(dump_file)
+
+
+def member_sizes(dump_file: str) -> List[int]:
+    """
+    Size in bytes of each file of dump file, numbered as in open_dump().
+    Archive member sizes come from tar headers, member contents aren't
+    read (but .tar.gz is still decompressed to get to them).
+    """
+    dump_file = os.path.expanduser(dump_file)
+    if dump_file.endswith(".tar.gz") or dump_file.endswith(".tar"):
+        mode = "r:gz" if dump_file.endswith(".tar.gz") else "r"
+        with tarfile.open(dump_file, mode=mode) as tar:
+            return [
+                member.size for member in tar if tar.extractfile(member) is not None
+            ]
+    return [os.path.getsize(dump_file)]
+
+
+class RangeReader:
+    """
+    Reads lines in byte ranges of dump file's files, a line belongs to
+    range it starts in. Dump file stays open between ranges, so ranges
+    read in dump order (skipping some is fine) read and decompress dump
+    once, not from the beginning for each range.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".ndjson") as f:
+    ...     _ = f.write(b"a\\nbb\\nccc\\nd\\n")
+    ...     f.flush()
+    ...     reader = RangeReader(f.name)
+    ...     ranges = ((0, 3), (3, 7), (7, 12), (1, 4))
+    ...     lines = [list(reader.lines(1, start, end)) for start, end in ranges]
+    ...     reader.close()
+    >>> lines[:3]
+    [[(0, b'a\\n'), (2, b'bb\\n')], [(5, b'ccc\\n')], [(9, b'd\\n')]]
+    >>> lines[3]
+    [(2, b'bb\\n')]
+    """
+
+    def __init__(self, dump_file: str):
+        self.dump_file = os.path.expanduser(dump_file)
+        self.stack: Optional[contextlib.ExitStack] = None
+        self.files: Iterator[IO[bytes]] = iter(())
+        self.file_number = 0
+        self.f: Optional[IO[bytes]] = None
+        # offset of next unread line in current file, end of last range read
+        self.offset = 0
+        self.end = 0
+
+    def close(self):
+        if self.stack is not None:
+            self.stack.close()
+            self.stack = None
+        self.file_number = 0
+        self.f = None
+
+    def seek_file(self, file_number: int) -> bool:
+        if self.stack is None or file_number < self.file_number:
+            # going back means reading dump from the beginning again
+            self.close()
+            self.stack = contextlib.ExitStack()
+            self.files = iter(
+                self.stack.enter_context(open_dump(self.dump_file, binary=True))
+            )
+        while self.file_number < file_number:
+            self.f = next(self.files, None)
+            if self.f is None:
+                return False
+            self.file_number += 1
+            self.offset = self.end = 0
+        return True
+
+    def lines(
+        self, file_number: int, start: int, end: int
+    ) -> Iterator[Tuple[int, bytes]]:
+        """
+        Yield offset and content of each line starting at or after
+        start and before end in file file_number (counted from 1).
+        """
+        if file_number == self.file_number and start < self.end:
+            self.close()
+        if not self.seek_file(file_number):
+            return
+        f = self.f
+        if start > self.offset:
+            # skip to first line starting at or after start
+            f.seek(start - 1)
+            self.offset = start - 1 + len(f.readline())
+        self.end = end
+        while self.offset < end:
+            line = f.readline()
+            if not line:
+                break
+            offset = self.offset
+            self.offset += len(line)
+            yield offset, line
+
+
+def parse_article(
+    line: Union[str, bytes],
+    info: si.Info,
+    source: str,
+    html_encoding="utf-8",
+    remove_embedded_bg="",
+    ensure_ext_image_urls=True,
+    minify=False,
+) -> convert.ConvertParams:
+    data = json.loads(line)
+    html = data["article_body"]["html"]
+    redirects = data.get("redirects", ())
+    return convert.ConvertParams(
+        title=data["name"],
+        aliases=[r["name"] for r in redirects],
+        text=html,
+        rtl=info.rtl,
+        server=info.server,
+        articlepath="./",  # TODO needs to be arg?
+        site_articlepath=info.articlepath,
+        encoding=html_encoding,
+        remove_embedded_bg=remove_embedded_bg,
+        ensure_ext_image_urls=ensure_ext_image_urls,
+        minify=minify,
+        source=source,
+    )
+
+
 def parse_loc_spec(s: str) -> Tuple[int, int]:
     if ":" in s:
         fileno, lineno = s.split(":")
@@ -67,7 +261,15 @@ def articles(
     html_encoding="utf-8",
     remove_embedded_bg="",
     ensure_ext_image_urls=True,
+    minify=False,
+    verbose=True,
+    position: Optional[ReadPosition] = None,
 ) -> Iterable[convert.ConvertParams]:
+    """
+    Read articles from dump files. With verbose, print location, title
+    and size of each article. If position is given, it is updated as
+    dump files are read.
+    """
 
     start_file, start_line = parse_loc_spec(start_line_spec)
     if end_line_spec:
@@ -78,22 +280,7 @@ def articles(
     for dump_file in dump_files:
         dump_file = os.path.expanduser(dump_file)
         print(f"Reading articles from ${dump_file}")
-        files: Iterable[Union[TextIOWrapper, IO[bytes]]] = []
-
-        if dump_file.endswith(".tar.gz") or dump_file.endswith(".tar"):
-            if dump_file.endswith(".tar.gz"):
-                tar = tarfile.open(dump_file, "r:gz")
-            else:
-                tar = tarfile.open(dump_file, "r")
-            ctx_manager = tar
-            files = (
-                f for f in (tar.extractfile(member) for member in tar) if f is not None
-            )
-        else:
-            ctx_manager = open(dump_file)
-            files = [ctx_manager]
-
-        with ctx_manager:
+        with open_dump(dump_file, position) as files:
             for k, f in enumerate(files):
                 file_number = k + 1
                 if file_number < start_file:
@@ -114,23 +301,57 @@ def articles(
                     if end_line and line_number > end_line:
                         break
                     try:
-                        data = json.loads(line)
-                        html = data["article_body"]["html"]
-                        title = data["name"]
-                        redirects = data.get("redirects", ())
-                        aliases = [r["name"] for r in redirects]
-                        print(f"{file_number}:{line_number} {title} ({len(html)})")
-                        yield convert.ConvertParams(
-                            title=title,
-                            aliases=aliases,
-                            text=html,
-                            rtl=info.rtl,
-                            server=info.server,
-                            articlepath="./",  # TODO needs to be arg?
-                            site_articlepath=info.articlepath,
-                            encoding=html_encoding,
+                        params = parse_article(
+                            line,
+                            info,
+                            f"{dump_file} {file_number}:{line_number}",
+                            html_encoding=html_encoding,
                             remove_embedded_bg=remove_embedded_bg,
                             ensure_ext_image_urls=ensure_ext_image_urls,
+                            minify=minify,
                         )
+                        if verbose:
+                            print(
+                                f"{file_number}:{line_number} {params.title} "
+                                f"({len(params.text)})"
+                            )
+                        yield params
                     except:
                         log.exception(f"Failed to read line {i}")
+
+
+def range_articles(
+    reader: RangeReader,
+    file_number: int,
+    start: int,
+    end: int,
+    info: si.Info,
+    html_encoding="utf-8",
+    remove_embedded_bg="",
+    ensure_ext_image_urls=True,
+    minify=False,
+    verbose=True,
+) -> Iterator[convert.ConvertParams]:
+    """
+    Read articles from byte range of dump file read by reader (see
+    RangeReader). With verbose, print location, title and size of each
+    article.
+    """
+    for offset, line in reader.lines(file_number, start, end):
+        source = f"{reader.dump_file} {file_number}@{offset}"
+        try:
+            params = parse_article(
+                line,
+                info,
+                source,
+                html_encoding=html_encoding,
+                remove_embedded_bg=remove_embedded_bg,
+                ensure_ext_image_urls=ensure_ext_image_urls,
+                minify=minify,
+            )
+        except Exception:
+            log.exception("Failed to read article at %s", source)
+            continue
+        if verbose:
+            print(f"{file_number}@{offset} {params.title} ({len(params.text)})")
+        yield params
@@ -0,0 +1,119 @@
+import time
+from typing import Iterable
+from typing import List
+
+import lxml.html
+
+from . import convert
+
+
+class SelectorStats:
+    """
+    Cost and effect of one filter selector over sample articles: time
+    spent selecting and dropping matching elements, number of matches,
+    number of articles with matches and size of removed HTML.
+    """
+
+    def __init__(self, selector: str):
+        self.selector = selector
+        self.seconds = 0.0
+        self.matches = 0
+        self.articles = 0
+        self.removed_bytes = 0
+
+    def bytes_per_ms(self) -> float:
+        return self.removed_bytes / (self.seconds * 1000) if self.seconds else 0.0
+
+
+def subtree_size(element) -> int:
+    return len(lxml.html.tostring(element, encoding="utf-8", with_tail=False))
+
+
+def profile_article(params: convert.ConvertParams, filters: List, stats: List):
+    # same document filters see in convert.convert
+    text = convert.NEWLINE_RE.sub("\n", params.text)
+    doc = convert.fromstring(text)
+    convert.CLEANER(doc)
+    convert.convert_geo(doc)
+
+    for selector, selector_stats in zip(filters, stats):
+        t0 = time.perf_counter()
+        if isinstance(selector, str):
+            # same HTML translator as conversion uses
+            selector = convert.CSSSelector(selector)
+        items = selector(doc)
+        selector_stats.seconds += time.perf_counter() - t0
+        if not items:
+            continue
+        selector_stats.matches += len(items)
+        selector_stats.articles += 1
+        # matching elements inside of other matching elements
+        # are removed with them and don't add to removed size
+        matched = set(items)
+        removed_bytes = sum(
+            subtree_size(item)
+            for item in items
+            if not any(parent in matched for parent in item.iterancestors())
+        )
+        t0 = time.perf_counter()
+        for item in items:
+            item.drop_tree()
+        selector_stats.seconds += time.perf_counter() - t0
+        selector_stats.removed_bytes += removed_bytes
+
+
+def profile_filters(
+    articles: Iterable[convert.ConvertParams], filters: Iterable[str]
+) -> List[SelectorStats]:
+    """
+    Apply filters to each article in order, like conversion does, and
+    collect stats for each selector.
+
+    >>> text = '<div class="x"><div class="x">a</div><p></p></div><p></p>'
+    >>> params = convert.ConvertParams("A", (), text,
+    ...     False, "https://w.org", "/wiki/$1", "/wiki/", "utf-8", "", False)
+    >>> for s in profile_filters([params] * 2, [".x", "p:empty", ".y"]):
+    ...     print(s.selector, s.matches, s.articles, s.removed_bytes)
+    .x 4 2 100
+    p:empty 2 2 14
+    .y 0 0 0
+    """
+    filters = list(filters)
+    stats = [SelectorStats(selector) for selector in filters]
+    selectors = convert.compile_filters(filters)
+    for params in articles:
+        profile_article(params, selectors, stats)
+    return stats
+
+
+SORT_KEYS = {
+    "time": lambda s: -s.seconds,
+    "matches": lambda s: -s.matches,
+    "bytes": lambda s: -s.removed_bytes,
+    "order": None,
+}
+
+
+def print_report(stats: List[SelectorStats], articles: int, sort: str = "time"):
+    total_seconds = sum(s.seconds for s in stats) or 1.0
+    if SORT_KEYS[sort]:
+        stats = sorted(stats, key=SORT_KEYS[sort])
+    width = min(max((len(s.selector) for s in stats), default=8), 50)
+    print(f"Filter selectors applied to {articles} articles")
+    print(
+        f"{'selector':{width}} {'total ms':>10} {'share':>6} {'us/article':>10} "
+        f"{'matches':>8} {'articles':>8} {'removed':>12} {'bytes/ms':>10}"
+    )
+    for s in stats:
+        print(
+            f"{s.selector[:width]:{width}} {s.seconds * 1000:10.1f} "
+            f"{s.seconds / total_seconds:6.1%} "
+            f"{s.seconds / max(articles, 1) * 1e6:10.1f} "
+            f"{s.matches:8} {s.articles:8} {s.removed_bytes:12} "
+            f"{s.bytes_per_ms():10.0f}"
+        )
+    unused = [s.selector for s in stats if not s.matches]
+    if unused:
+        print(f"\n{len(unused)} selectors matched nothing:")
+        for selector in unused:
+            print(f"  {selector}")
@@ -0,0 +1,185 @@
+import contextlib
+import http.server
+import os
+import threading
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from .progress import LATENCY_BUCKETS
+from .progress import Progress
+from .progress import child_pids
+from .progress import rss
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PHASES = ("content", "finalize", "sort", "resolve_aliases", "done")
+
+
+def metric(lines: List[str], name: str, kind: str, help_text: str, samples: dict):
+    lines.append(f"# HELP mw2slob_{name} {help_text}")
+    lines.append(f"# TYPE mw2slob_{name} {kind}")
+    for labels, value in samples.items():
+        lines.append(f"mw2slob_{name}{labels} {value}")
+
+
+def exposition(progress: Progress) -> str:
+    """
+    Progress counters in Prometheus text exposition format.
+
+    >>> progress = Progress()
+    >>> progress.stored = 2
+    >>> progress.batch_done([0.02, 0.3])
+    >>> lines = exposition(progress).splitlines()
+    >>> lines[lines.index("# TYPE mw2slob_articles_total counter") + 1]
+    'mw2slob_articles_total{result="stored"} 2'
+    >>> buckets = [line for line in lines if "_seconds_bucket" in line]
+    >>> for line in buckets[:3] + buckets[-1:]:
+    ...     print(line)
+    mw2slob_conversion_seconds_bucket{le="0.01"} 0
+    mw2slob_conversion_seconds_bucket{le="0.025"} 1
+    mw2slob_conversion_seconds_bucket{le="0.05"} 1
+    mw2slob_conversion_seconds_bucket{le="+Inf"} 2
+    """
+    lines: List[str] = []
+    metric(
+        lines,
+        "articles_read_total",
+        "counter",
+        "Articles read from input",
+        {"": progress.articles_read},
+    )
+    metric(
+        lines,
+        "articles_total",
+        "counter",
+        "Articles converted, by result",
+        {
+            '{result="stored"}': progress.stored,
+            '{result="duplicate"}': progress.duplicates,
+            '{result="empty"}': progress.empty,
+            '{result="failed"}': progress.failed,
+        },
+    )
+    metric(
+        lines,
+        "input_chars_total",
+        "counter",
+        "Characters of article HTML read",
+        {"": progress.input_chars},
+    )
+    metric(
+        lines,
+        "output_bytes_total",
+        "counter",
+        "Bytes of converted article HTML stored",
+        {"": progress.output_bytes},
+    )
+
+    counts = list(progress.latency_counts)
+    buckets = {}
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, counts):
+        cumulative += count
+        buckets[f'_bucket{{le="{bound}"}}'] = cumulative
+    cumulative += counts[-1]
+    buckets['_bucket{le="+Inf"}'] = cumulative
+    buckets["_sum"] = progress.latency_sum
+    buckets["_count"] = cumulative
+    metric(
+        lines,
+        "conversion_seconds",
+        "histogram",
+        "Time article conversion took in worker, including retries",
+        buckets,
+    )
+
+    metric(
+        lines,
+        "in_flight_articles",
+        "gauge",
+        "Articles read but not yet added",
+        {"": progress.articles_read - progress.done()},
+    )
+    metric(
+        lines,
+        "pending_batches",
+        "gauge",
+        "Article batches handed out to workers and not yet converted",
+        {"": progress.batches_sent - progress.batches_done},
+    )
+
+    current = progress.current_phase()
+    phases = dict.fromkeys(PHASES, 0)
+    phases[current] = 1
+    metric(
+        lines,
+        "phase",
+        "gauge",
+        "Current slob creation phase",
+        {f'{{phase="{phase}"}}': value for phase, value in phases.items()},
+    )
+    metric(
+        lines,
+        "phase_seconds",
+        "gauge",
+        "Time spent in each slob creation phase so far",
+        {
+            f'{{phase="{phase}"}}': round(seconds, 3)
+            for phase, seconds in progress.phase_seconds().items()
+        },
+    )
+
+    memory = {'{process="main"}': rss(os.getpid()) or 0}
+    for pid in child_pids(os.getpid()):
+        memory[f'{{process="worker",pid="{pid}"}}'] = rss(pid) or 0
+    metric(
+        lines,
+        "resident_memory_bytes",
+        "gauge",
+        "Resident memory of this process and of worker processes",
+        memory,
+    )
+    return "\n".join(lines) + "\n"
+
+
+def handler_class(progress: Progress):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = exposition(progress).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes every few seconds would flood output
+            pass
+
+    return Handler
+
+
+@contextlib.contextmanager
+def serve(
+    progress: Optional[Progress], port: Optional[int], host: str = "127.0.0.1"
+) -> Iterator[None]:
+    """
+    Serve metrics at http://host:port/metrics in a background thread
+    for the duration of block. Does nothing if port is not given.
+    """
+    if not port or progress is None:
+        yield
+        return
+    server = http.server.ThreadingHTTPServer((host, port), handler_class(progress))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,148 @@
+import contextlib
+import cProfile
+import glob
+import io
+import multiprocessing.util
+import os
+import pstats
+import threading
+import time
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# directory to save stats to if profiling is enabled in this process
+PROFILE_DIR: Optional[str] = None
+
+# main thread profiler of main process
+MAIN: Optional[cProfile.Profile] = None
+
+# (role, profiler) of this process, one per profiled thread
+PROFILERS: List[Tuple[str, cProfile.Profile]] = []
+
+local = threading.local()
+
+MERGED = "merged.prof"
+REPORT = "report.txt"
+REPORT_LINES = 40
+
+# main: main thread of main process
+# reader: thread reading articles and handing them out to workers
+# worker: threads or processes converting articles
+ROLES = ("main", "reader", "worker")
+
+
+def get_profiler(role: str) -> cProfile.Profile:
+    profiler = getattr(local, "profiler", None)
+    if profiler is None:
+        profiler = local.profiler = cProfile.Profile()
+        PROFILERS.append((role, profiler))
+    return profiler
+
+
+@contextlib.contextmanager
+def profiled(role: str = "worker"):
+    """
+    Profile block with this thread's profiler if profiling is enabled
+    in this process, otherwise do nothing.
+    """
+    if PROFILE_DIR is None:
+        yield
+        return
+    profiler = get_profiler(role)
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one active profiler per process, which
+        # is the main one in main process and already covers this thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+def dump():
+    for i, (role, profiler) in enumerate(PROFILERS):
+        profiler.dump_stats(
+            os.path.join(PROFILE_DIR, f"{role}-{os.getpid()}-{i}.prof")
+        )
+
+
+def init_worker(profile_dir: Optional[str]):
+    """
+    Enable profiling in worker process, stats are saved when
+    process exits normally.
+    """
+    global PROFILE_DIR, MAIN, PROFILERS, local
+    # forked worker inherits main process profiler, active in its
+    # main thread
+    if MAIN is not None:
+        MAIN.disable()
+        MAIN = None
+    PROFILERS = []
+    local = threading.local()
+    PROFILE_DIR = profile_dir
+    if profile_dir:
+        multiprocessing.util.Finalize(None, dump, exitpriority=10)
+
+
+def merge(profile_dir: str, since: float) -> str:
+    """
+    Merge stats files saved in profile_dir since given time into one
+    file and write text report of functions with most own and
+    cumulative time for each role (see ROLES) separately. Returns
+    report file name.
+    """
+    names = sorted(
+        name
+        for name in glob.glob(os.path.join(profile_dir, "*.prof"))
+        if os.path.basename(name) != MERGED and os.path.getmtime(name) >= since
+    )
+    stats = pstats.Stats(*names, stream=io.StringIO())
+    stats.dump_stats(os.path.join(profile_dir, MERGED))
+    report_name = os.path.join(profile_dir, REPORT)
+    with open(report_name, "w") as f:
+        for role in ROLES:
+            role_names = [
+                name
+                for name in names
+                if os.path.basename(name).startswith(f"{role}-")
+            ]
+            if not role_names:
+                continue
+            role_stats = pstats.Stats(*role_names, stream=f)
+            for sort in ("tottime", "cumulative"):
+                f.write(f"\n{role}: top {REPORT_LINES} functions by {sort}\n")
+                role_stats.sort_stats(sort).print_stats(REPORT_LINES)
+    return report_name
+
+
+@contextlib.contextmanager
+def profile(profile_dir: Optional[str]):
+    """
+    Profile main thread of this process, as well as threads that
+    read or convert articles, for the duration of block, then merge stats of
+    this process and of worker processes into one report.
+    """
+    global PROFILE_DIR, MAIN
+    if not profile_dir:
+        yield
+        return
+    os.makedirs(profile_dir, exist_ok=True)
+    # profile files have one second mtime resolution on some filesystems
+    since = int(time.time())
+    PROFILE_DIR = profile_dir
+    MAIN = local.profiler = cProfile.Profile()
+    PROFILERS.append(("main", MAIN))
+    MAIN.enable()
+    try:
+        yield
+    finally:
+        MAIN.disable()
+        dump()
+        print(f"\nProfile report: {merge(profile_dir, since)}")
+        PROFILE_DIR = MAIN = None
+        PROFILERS.clear()
+        del local.profiler
@@ -0,0 +1,280 @@
+import bisect
+import contextlib
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from typing import IO
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+# seconds between progress records
+INTERVAL = 10.0
+
+# upper bounds of conversion time histogram buckets, seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss(pid: int) -> Optional[int]:
+    """
+    Resident set size of process in bytes, None if it can't be
+    determined (process is gone or no /proc on this platform).
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def child_pids(pid: int) -> List[int]:
+    """
+    Process ids of children of process (started by any of its
+    threads), such as conversion pool workers. Empty if there's no
+    /proc on this platform.
+    """
+    pids = []
+    for name in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(name) as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            pass
+    return sorted(pids)
+
+
+def eta(elapsed: float, start: float, current: float) -> Optional[float]:
+    """
+    Seconds left at current rate given fractions of input read at
+    start and now.
+
+    >>> eta(10.0, 0.0, 0.25)
+    30.0
+    >>> eta(10.0, 0.5, 0.75)
+    10.0
+    >>> eta(10.0, 0.5, 0.5) is None
+    True
+    """
+    if current <= start:
+        return None
+    return elapsed * (1.0 - current) / (current - start)
+
+
+class Progress:
+    """
+    Counts articles and bytes as they are read, converted and stored,
+    collects conversion times and slob creation phase durations. If
+    log file is given, periodically writes a JSON line with counters,
+    rates, pending batches, process memory use and estimated time
+    left to it.
+
+    Counters are updated from the thread reading articles and from the
+    thread storing results and read from the thread writing records
+    (or serving metrics), each counter has single writer. Log file is
+    closed when done.
+
+    >>> progress = Progress()
+    >>> progress.start()
+    >>> progress.batch_done([0.02, 0.3, 100.0])
+    >>> progress.latency_counts
+    [0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1]
+    >>> progress.close()
+    >>> progress.current_phase(), sorted(progress.phase_seconds())
+    ('done', ['content'])
+    """
+
+    def __init__(
+        self,
+        log_file: Optional[IO[str]] = None,
+        interval: float = INTERVAL,
+        position=None,
+    ):
+        self.log_file = log_file
+        self.interval = interval
+        # dump.ReadPosition of input, if known
+        self.position = position
+        self.phase = "content"
+        self.articles_read = 0
+        self.input_chars = 0
+        self.batches_sent = 0
+        self.batches_done = 0
+        self.stored = 0
+        self.duplicates = 0
+        self.empty = 0
+        self.failed = 0
+        self.output_bytes = 0
+        # last one counts conversions over highest bucket bound
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        # phase -> monotonic time it started, durations of finished phases
+        self.phase_started: Dict[str, float] = {}
+        self.phase_durations: Dict[str, float] = {}
+        self.started = time.monotonic()
+        self.start_fraction: Optional[float] = None
+        self.last_time = self.started
+        self.last_done = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        if self.position is not None:
+            self.start_fraction = self.position.fraction()
+        self.begin_phase("content")
+        if self.log_file is not None:
+            self.thread.start()
+
+    def read_batch(self, batch):
+        self.batches_sent += 1
+        self.articles_read += len(batch)
+        self.input_chars += sum(len(params.text or "") for params in batch)
+
+    def batch_done(self, seconds: Iterable[float] = ()):
+        for value in seconds:
+            self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            self.latency_sum += value
+        self.batches_done += 1
+
+    def begin_phase(self, phase: str):
+        self.phase = phase
+        self.phase_started[phase] = time.monotonic()
+
+    def end_phase(self, phase: str):
+        started = self.phase_started.pop(phase, None)
+        if started is not None:
+            self.phase_durations[phase] = time.monotonic() - started
+
+    def current_phase(self) -> str:
+        # phases nest (sort and resolving aliases happen while finalizing)
+        running = dict(self.phase_started)
+        if running:
+            return max(running, key=running.__getitem__)
+        return self.phase
+
+    def phase_seconds(self) -> Dict[str, float]:
+        """Durations of finished and running phases"""
+        now = time.monotonic()
+        seconds = dict(self.phase_durations)
+        for phase, started in list(self.phase_started.items()):
+            seconds[phase] = now - started
+        return seconds
+
+    def done(self) -> int:
+        return self.stored + self.duplicates + self.empty + self.failed
+
+    def record(self, event: str = "progress") -> Dict:
+        now = time.monotonic()
+        elapsed = now - self.started
+        done = self.done()
+        recent = (done - self.last_done) / (now - self.last_time or 1e-9)
+        self.last_time = now
+        self.last_done = done
+        rate = done / elapsed if elapsed else 0.0
+        output_rate = self.output_bytes / elapsed if elapsed else 0.0
+        record = {
+            "event": event,
+            "time": time.time(),
+            "elapsed": round(elapsed, 3),
+            "phase": self.current_phase(),
+            "articles_read": self.articles_read,
+            "articles_done": done,
+            "stored": self.stored,
+            "duplicates": self.duplicates,
+            "empty": self.empty,
+            "failed": self.failed,
+            "input_chars": self.input_chars,
+            "output_bytes": self.output_bytes,
+            "articles_per_s": round(rate, 2),
+            "recent_articles_per_s": round(recent, 2),
+            "output_mb_per_s": round(output_rate / 1e6, 3),
+            "pending_batches": self.batches_sent - self.batches_done,
+            "rss": rss(os.getpid()),
+            "worker_rss": [rss(pid) for pid in child_pids(os.getpid())],
+        }
+        if self.position is not None and self.start_fraction is not None:
+            fraction = self.position.fraction()
+            record["input_fraction"] = round(fraction, 4)
+            seconds_left = eta(elapsed, self.start_fraction, fraction)
+            record["eta"] = None if seconds_left is None else round(seconds_left)
+        return record
+
+    def write(self, event: str = "progress"):
+        if self.log_file is None:
+            return
+        with self.lock:
+            self.log_file.write(json.dumps(self.record(event)) + "\n")
+            self.log_file.flush()
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def observer(self, observer=None):
+        """
+        slob.create observer that also records phase changes (sort,
+        resolve aliases, finalize), calling given observer too.
+        """
+
+        def observe(e):
+            if e.name.startswith("begin_"):
+                # adding content is over once slob starts finalizing
+                self.end_phase("content")
+                self.begin_phase(e.name[len("begin_") :])
+                self.write(e.name)
+            elif e.name.startswith("end_"):
+                self.end_phase(e.name[len("end_") :])
+                self.write(e.name)
+            if observer:
+                observer(e)
+
+        return observe
+
+    def close(self):
+        self.end_phase("content")
+        self.phase = "done"
+        if self.log_file is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.write("done")
+        if self.log_file is not sys.stderr:
+            self.log_file.close()
+
+
+@contextlib.contextmanager
+def started(progress: Optional[Progress]) -> Iterator[Optional[Progress]]:
+    """
+    Progress started for the duration of block, if given. It is closed
+    even if block fails, so that log file gets final record and is
+    closed.
+
+    >>> progress = Progress()
+    >>> try:
+    ...     with started(progress):
+    ...         raise ValueError
+    ... except ValueError:
+    ...     pass
+    >>> progress.current_phase()
+    'done'
+    """
+    if progress is None:
+        yield None
+        return
+    progress.start()
+    try:
+        yield progress
+    finally:
+        progress.close()
+
+
+def open_log(name: str) -> IO[str]:
+    if name == "-":
+        return sys.stderr
+    return open(name, "a", encoding="utf-8")
@@ -0,0 +1,87 @@
+import contextlib
+import gzip
+import json
+import logging
+import time
+from typing import Iterator
+from typing import Optional
+
+from . import convert
+
+log = logging.getLogger(__name__)
+
+
+class Quarantine:
+    """
+    Appends failed articles to gzipped JSON lines file, one record
+    per article with title, source, error, traceback and conversion
+    parameters. Each run appends a new gzip member, which gzip reads
+    as one stream.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.count = 0
+
+    def add(self, title: str, error: str):
+        params = getattr(error, "params", None)
+        if params is not None:
+            # scrape gives aliases as set
+            params = params._replace(aliases=list(params.aliases or ()))
+        record = {
+            "title": title,
+            "source": params.source if params else None,
+            "error": str(error),
+            "traceback": getattr(error, "traceback", ""),
+            "time": time.time(),
+            "params": params._asdict() if params else None,
+        }
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def summary(self) -> str:
+        return f"Saved {self.count} failed articles to {self.path}"
+
+
+@contextlib.contextmanager
+def opened(path: Optional[str]) -> Iterator[Optional[Quarantine]]:
+    """
+    Quarantine for the duration of block, None if path is not given.
+    File is closed even if block fails, so records of failed run are
+    still readable.
+    """
+    if not path:
+        yield None
+        return
+    failed = Quarantine(path)
+    try:
+        yield failed
+    finally:
+        failed.close()
+
+
+def read(path: str) -> Iterator[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def to_params(record: dict) -> Optional[convert.ConvertParams]:
+    """
+    Conversion parameters saved in quarantine record, None if there
+    are none (failure was reported without them).
+    """
+    saved = record.get("params")
+    if not saved:
+        return None
+    fields = {
+        name: value
+        for name, value in saved.items()
+        if name in convert.ConvertParams._fields
+    }
+    fields["aliases"] = tuple(fields.get("aliases") or ())
+    return convert.ConvertParams(**fields)
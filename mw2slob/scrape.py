@@ -40,6 +40,7 @@ def articles(
     html_encoding="utf-8",
     remove_embedded_bg="",
     ensure_ext_image_urls=True,
+    minify=False,
 ):
 
     couch, _ = mkcouch(couch_url)
@@ -65,6 +66,7 @@ def articles(
             encoding=html_encoding,
             remove_embedded_bg=remove_embedded_bg,
             ensure_ext_image_urls=ensure_ext_image_urls,
+            minify=minify,
         )
 
     def articles_from_viewiter(viewiter):
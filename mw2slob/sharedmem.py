@@ -0,0 +1,138 @@
+import collections
+import queue
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict
+from typing import List
+from typing import Sequence
+
+# Location of article text or converted html in slot's shared memory,
+# sent to and from worker processes instead of the data itself
+SharedRef = collections.namedtuple("SharedRef", ["offset", "length"])
+
+# Batch of articles sent to worker, texts that fit into slot's input
+# buffer replaced with SharedRef
+SharedBatch = collections.namedtuple(
+    "SharedBatch", ["slot", "input_name", "output_name", "articles"]
+)
+
+
+class Slot:
+    def __init__(self, size: int):
+        self.input = SharedMemory(create=True, size=size)
+        self.output = SharedMemory(create=True, size=size)
+
+    def close(self):
+        for memory in (self.input, self.output):
+            memory.close()
+            memory.unlink()
+
+
+class Slots:
+    """
+    Shared memory buffers for batches in flight, reused as results come
+    back. Each slot has input buffer for article texts and output
+    buffer for converted html, size bytes each. Texts and results that
+    don't fit are sent through pipe as usual.
+
+    >>> slots = Slots(1, 16)
+    >>> from mw2slob.convert import ConvertParams
+    >>> a = ConvertParams(*("a", (), "text", False), *(None,) * 6)
+    >>> b = a._replace(title="b", text="long text " * 2)
+    >>> shared = slots.pack([a, b])
+    >>> [params.text for params in shared.articles]
+    [SharedRef(offset=0, length=4), 'long text long text ']
+    >>> [params.text for params in read_batch(shared)]
+    ['text', 'long text long text ']
+    >>> results = write_results(shared, [("a", (), b"<p>", None), ("b", (), b"<p>b", None)])
+    >>> results[1]
+    [('a', (), SharedRef(offset=0, length=3), None), ('b', (), SharedRef(offset=3, length=4), None)]
+    >>> slots.unpack(results)
+    [('a', (), b'<p>', None), ('b', (), b'<p>b', None)]
+    >>> slots.close()
+    """
+
+    def __init__(self, count: int, size: int):
+        self.size = size
+        self.slots: List[Slot] = []
+        self.free: "queue.SimpleQueue[int]" = queue.SimpleQueue()
+        try:
+            for i in range(count):
+                self.slots.append(Slot(size))
+                self.free.put(i)
+        except:
+            self.close()
+            raise
+
+    def pack(self, articles: Sequence) -> SharedBatch:
+        # caller makes sure there are no more batches in flight than slots,
+        # so this doesn't block
+        index = self.free.get()
+        slot = self.slots[index]
+        buf = slot.input.buf
+        offset = 0
+        packed = []
+        for params in articles:
+            if params.text is not None:
+                data = params.text.encode("utf-8")
+                end = offset + len(data)
+                if end <= self.size:
+                    buf[offset:end] = data
+                    params = params._replace(text=SharedRef(offset, len(data)))
+                    offset = end
+            packed.append(params)
+        return SharedBatch(index, slot.input.name, slot.output.name, packed)
+
+    def unpack(self, shared_results) -> List:
+        index, results = shared_results
+        buf = self.slots[index].output.buf
+        unpacked = []
+        for title, aliases, html, error in results:
+            if isinstance(html, SharedRef):
+                html = bytes(buf[html.offset : html.offset + html.length])
+            unpacked.append((title, aliases, html, error))
+        self.free.put(index)
+        return unpacked
+
+    def close(self):
+        for slot in self.slots:
+            slot.close()
+        self.slots.clear()
+
+
+# shared memory of parent process attached in worker process
+ATTACHED: Dict[str, SharedMemory] = {}
+
+
+def attach(name: str) -> SharedMemory:
+    memory = ATTACHED.get(name)
+    if memory is None:
+        memory = ATTACHED[name] = SharedMemory(name=name)
+    return memory
+
+
+def read_batch(shared_batch: SharedBatch) -> List:
+    buf = attach(shared_batch.input_name).buf
+    articles = []
+    for params in shared_batch.articles:
+        ref = params.text
+        if isinstance(ref, SharedRef):
+            text = str(buf[ref.offset : ref.offset + ref.length], "utf-8")
+            params = params._replace(text=text)
+        articles.append(params)
+    return articles
+
+
+def write_results(shared_batch: SharedBatch, results: Sequence):
+    memory = attach(shared_batch.output_name)
+    buf = memory.buf
+    offset = 0
+    packed = []
+    for title, aliases, html, error in results:
+        if html:
+            end = offset + len(html)
+            if end <= memory.size:
+                buf[offset:end] = html
+                html = SharedRef(offset, len(html))
+                offset = end
+        packed.append((title, aliases, html, error))
+    return shared_batch.slot, packed
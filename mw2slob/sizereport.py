@@ -0,0 +1,111 @@
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Mapping
+from typing import Tuple
+
+import slob
+
+from . import convert
+from . import core
+
+# same codecs (and settings, such as raw lzma2 without container) slob
+# compresses bins with
+COMPRESSIONS: Mapping[str, Callable[[bytes], bytes]] = {
+    name: slob.COMPRESSIONS[name].compress for name in ("zlib", "lzma2")
+}
+
+
+def make_bins(items: Iterable[bytes], bin_size: int) -> Iterator[List[bytes]]:
+    """
+    Group items into bins of at least bin_size bytes (last one may be
+    smaller), like slob writer does.
+
+    >>> [len(b) for b in make_bins([b"a" * 10] * 5, 25)]
+    [3, 2]
+    """
+    current_bin: List[bytes] = []
+    current_bin_size = 0
+    for item in items:
+        current_bin.append(item)
+        current_bin_size += len(item)
+        if current_bin_size >= bin_size:
+            yield current_bin
+            current_bin = []
+            current_bin_size = 0
+    if current_bin:
+        yield current_bin
+
+
+def compressed_size(items: Iterable[bytes], compress, bin_size: int) -> int:
+    """
+    Total size of items compressed in bins of at least bin_size bytes,
+    like slob stores them.
+
+    >>> compressed_size([b"a" * 10] * 10, lambda x: x[:1], 25)
+    4
+    """
+    return sum(
+        len(compress(b"".join(current_bin)))
+        for current_bin in make_bins(items, bin_size)
+    )
+
+
+def convert_sample(
+    articles: List[convert.ConvertParams],
+    filters: Iterable[str],
+    interwikimap: Iterable[Mapping[str, str]],
+    namespaces: Mapping[str, dict],
+) -> List[bytes]:
+    return [
+        text
+        for _, _, text, _ in core.convert_all(
+            articles, filters, interwikimap, namespaces
+        )
+        if text
+    ]
+
+
+def size_report(
+    articles: Iterable[convert.ConvertParams],
+    filters: Iterable[str],
+    interwikimap: Iterable[Mapping[str, str]],
+    namespaces: Mapping[str, dict],
+    bin_size: int = core.Defaults.min_bin_size * 1024,
+) -> List[Tuple[str, int, Mapping[str, int]]]:
+    """
+    Convert articles with and without minification and return
+    converted and compressed sizes for each variant.
+    """
+    sample = list(articles)
+    report = []
+    for name, minify in (("original", False), ("minified", True)):
+        converted = convert_sample(
+            [params._replace(minify=minify) for params in sample],
+            filters,
+            interwikimap,
+            namespaces,
+        )
+        compressed = {
+            compression: compressed_size(converted, compress, bin_size)
+            for compression, compress in COMPRESSIONS.items()
+        }
+        report.append((name, sum(len(text) for text in converted), compressed))
+    return report
+
+
+def print_report(report: List[Tuple[str, int, Mapping[str, int]]]):
+    (_, base_size, base_compressed), *_ = report
+    compressions = list(base_compressed)
+    print(f"{'':10} {'html':>14}", *(f"{c:>14}" for c in compressions))
+    for name, size, compressed in report:
+        cells = [f"{size:>14}"]
+        cells += [f"{compressed[c]:>14}" for c in compressions]
+        print(f"{name:10}", *cells)
+        if size != base_size:
+            cells = [f"{size / base_size:>14.1%}"]
+            cells += [
+                f"{compressed[c] / base_compressed[c]:>14.1%}" for c in compressions
+            ]
+            print(f"{'':10}", *cells)
@@ -0,0 +1,127 @@
+import heapq
+import math
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import Tuple
+
+from .convert import STAGES
+
+# histogram buckets per tenfold increase of duration, percentiles are
+# accurate to about 12%
+BUCKETS_PER_DECADE = 10
+
+SLOWEST = 5
+
+
+def bucket(seconds: float) -> int:
+    return math.floor(math.log10(max(seconds, 1e-7)) * BUCKETS_PER_DECADE)
+
+
+def bucket_value(index: int) -> float:
+    return 10 ** ((index + 0.5) / BUCKETS_PER_DECADE)
+
+
+class StageStats:
+    """
+    Conversion stage durations of many articles: totals, histograms for
+    percentiles and slowest articles for each stage. Worker processes
+    collect stats for each batch of articles, which are then merged.
+
+    >>> stats = StageStats()
+    >>> for i in range(1, 101):
+    ...     stats.add(f"a{i}", {"parse": i / 1000, "serialize": 0.001})
+    >>> other = StageStats()
+    >>> other.add("b", {"parse": 2.0})
+    >>> stats.merge(other)
+    >>> stats.articles, round(stats.totals["parse"], 3)
+    (101, 7.05)
+    >>> [round(p, 3) for p in stats.percentiles("parse", (50, 90))]
+    [0.056, 0.089]
+    >>> [title for _, title in stats.slowest_articles("parse")]
+    ['b', 'a100', 'a99', 'a98', 'a97']
+    """
+
+    def __init__(self, slowest: int = SLOWEST):
+        self.slowest = slowest
+        self.articles = 0
+        self.totals: Dict[str, float] = {}
+        self.histograms: Dict[str, Dict[int, int]] = {}
+        # min heaps of (seconds, title)
+        self.slowest_heaps: Dict[str, List[Tuple[float, str]]] = {}
+
+    def add(self, title: str, timings: Mapping[str, float]):
+        self.articles += 1
+        for stage, seconds in timings.items():
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+            histogram = self.histograms.setdefault(stage, {})
+            index = bucket(seconds)
+            histogram[index] = histogram.get(index, 0) + 1
+            self.push_slow(stage, seconds, title)
+
+    def push_slow(self, stage: str, seconds: float, title: str):
+        heap = self.slowest_heaps.setdefault(stage, [])
+        if len(heap) < self.slowest:
+            heapq.heappush(heap, (seconds, title))
+        elif seconds > heap[0][0]:
+            heapq.heapreplace(heap, (seconds, title))
+
+    def merge(self, other: "StageStats"):
+        self.articles += other.articles
+        for stage, seconds in other.totals.items():
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+        for stage, other_histogram in other.histograms.items():
+            histogram = self.histograms.setdefault(stage, {})
+            for index, count in other_histogram.items():
+                histogram[index] = histogram.get(index, 0) + count
+        for stage, heap in other.slowest_heaps.items():
+            for seconds, title in heap:
+                self.push_slow(stage, seconds, title)
+
+    def percentiles(self, stage: str, percents) -> List[float]:
+        histogram = self.histograms.get(stage, {})
+        count = sum(histogram.values())
+        values = []
+        for percent in percents:
+            rank = percent / 100 * count
+            seen = 0
+            for index in sorted(histogram):
+                seen += histogram[index]
+                if seen >= rank:
+                    values.append(bucket_value(index))
+                    break
+            else:
+                values.append(0.0)
+        return values
+
+    def slowest_articles(self, stage: str) -> List[Tuple[float, str]]:
+        return sorted(self.slowest_heaps.get(stage, ()), reverse=True)
+
+    def stages(self) -> List[str]:
+        known = [stage for stage in STAGES if stage in self.totals]
+        return known + sorted(set(self.totals) - set(known))
+
+    def report(self) -> str:
+        total = sum(self.totals.values()) or 1.0
+        lines = [
+            f"Conversion stage times, {self.articles} articles",
+            f"{'stage':10} {'total s':>10} {'share':>6} "
+            f"{'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+        ]
+        for stage in self.stages():
+            slowest = self.slowest_articles(stage)
+            longest = slowest[0][0] if slowest else 0.0
+            # histogram gives bucket middle, which may be above actual maximum
+            p50, p90, p99 = (
+                min(p, longest) for p in self.percentiles(stage, (50, 90, 99))
+            )
+            lines.append(
+                f"{stage:10} {self.totals[stage]:10.2f} "
+                f"{self.totals[stage] / total:6.1%} {p50 * 1000:9.2f} "
+                f"{p90 * 1000:9.2f} {p99 * 1000:9.2f} {longest * 1000:9.1f}"
+            )
+        for stage in self.stages():
+            lines.append(f"Slowest in {stage}:")
+            for seconds, title in self.slowest_articles(stage):
+                lines.append(f"  {seconds * 1000:9.1f} ms  {title}")
+        return "\n".join(lines)